@@ -1,5 +1,18 @@
 import utime
 
+from .scheduler import earliest
+
+# The rainbow brightens over SWEEP_MS and fades over the same again, then the
+# valves click in turn: on VALVE_ON_SPACING_MS apart, a VALVE_HOLD_MS pause,
+# and off VALVE_OFF_SPACING_MS apart. Much the timing the blocking sequence
+# had, which slept through it.
+SWEEP_MS = 500
+SWEEP_BRIGHTNESS = 0.28
+VALVE_ON_SPACING_MS = 120
+VALVE_HOLD_MS = 120
+VALVE_OFF_SPACING_MS = 80
+
+
 def wheel(pos):
     if pos < 0 or pos > 255:
         return (0, 0, 0)
@@ -12,25 +25,105 @@ def wheel(pos):
     return (pos * 3, 0, 255 - pos * 3)
 
 
-def run_boot_sequence(renderer, valves):
-    for i in range(255):
-        brightness = (i / 255) * 0.28
-        for j in range(12):
-            rc_index = (j * 256 // 12) + i
-            renderer.set_led_color(j, wheel(rc_index & 255), brightness)
-            utime.sleep_us(100)
-    for i in range(255):
-        brightness = 0.28 - ((i / 255) * 0.28)
-        for j in range(12):
-            rc_index = (j * 256 // 12) + i
-            renderer.set_led_color(j, wheel(rc_index & 255), brightness)
-            utime.sleep_us(100)
-
-    for i in range(len(valves)):
-      valves[i].activate()
-      utime.sleep_ms(120)
-
-
-    for i in range(len(valves)):
-      utime.sleep_ms(80)
-      valves[i].deactivate()
+class BootSequence:
+    """The rainbow sweep and valve self-test, as a task in the main loop.
+
+    It used to run before the loop and block it for well over a second, with
+    the buttons, pedals and USB dead throughout. Now the loop starts first and
+    this paints a step whenever its deadline comes, so the pump answers input
+    from its first pass.
+
+    Any input ends it early: ``interrupt()`` hands the LEDs back and releases
+    the valves the self-test holds, so the user's press gets the valves to
+    itself. ``on_finished`` is called once, either way.
+    """
+
+    def __init__(self, renderer, valves, frame_interval_ms, on_finished=None):
+        self.renderer = renderer
+        self.valves = valves
+        self.frame_interval_ms = frame_interval_ms
+        self.on_finished = on_finished
+        self.started_ms = None
+        self.next_frame_ms = None
+        self.finished = False
+
+        # (offset from the start, valve index, level), in time order.
+        valves_at_ms = 2 * SWEEP_MS
+        steps = []
+        for index in range(len(valves)):
+            steps.append((valves_at_ms + index * VALVE_ON_SPACING_MS, index, 1))
+        off_at_ms = valves_at_ms + len(valves) * VALVE_ON_SPACING_MS + VALVE_HOLD_MS
+        for index in range(len(valves)):
+            steps.append((off_at_ms + index * VALVE_OFF_SPACING_MS, index, 0))
+        self.valve_steps = steps
+        self.next_step = 0
+        self.holding = [False] * len(valves)
+
+    def start(self):
+        self.started_ms = utime.ticks_ms()
+        self.next_frame_ms = self.started_ms
+
+    def next_deadline(self):
+        if self.finished or self.started_ms is None:
+            return None
+        due = self.next_frame_ms
+        if self.next_step < len(self.valve_steps):
+            due = earliest(due, utime.ticks_add(
+                self.started_ms, self.valve_steps[self.next_step][0]))
+        return due
+
+    def tick(self):
+        if self.finished or self.started_ms is None:
+            return
+        now_ms = utime.ticks_ms()
+        elapsed_ms = utime.ticks_diff(now_ms, self.started_ms)
+
+        if self.next_frame_ms is not None and utime.ticks_diff(now_ms, self.next_frame_ms) >= 0:
+            self.paint(elapsed_ms)
+            if elapsed_ms >= 2 * SWEEP_MS:
+                self.next_frame_ms = None
+            else:
+                self.next_frame_ms = utime.ticks_add(now_ms, self.frame_interval_ms)
+
+        while (self.next_step < len(self.valve_steps)
+               and self.valve_steps[self.next_step][0] <= elapsed_ms):
+            _, index, level = self.valve_steps[self.next_step]
+            if level:
+                self.valves[index].activate()
+            else:
+                self.valves[index].deactivate()
+            self.holding[index] = level == 1
+            self.next_step += 1
+
+        if self.next_frame_ms is None and self.next_step >= len(self.valve_steps):
+            self.finish()
+
+    def paint(self, elapsed_ms):
+        if elapsed_ms >= 2 * SWEEP_MS:
+            brightness = 0.0
+            position = 254
+        elif elapsed_ms >= SWEEP_MS:
+            position = (elapsed_ms - SWEEP_MS) * 255 // SWEEP_MS
+            brightness = SWEEP_BRIGHTNESS - (position / 255) * SWEEP_BRIGHTNESS
+        else:
+            position = elapsed_ms * 255 // SWEEP_MS
+            brightness = (position / 255) * SWEEP_BRIGHTNESS
+        for j in range(self.renderer.led_count):
+            rc_index = (j * 256 // self.renderer.led_count) + position
+            self.renderer.set_led_color(j, wheel(rc_index & 255), brightness)
+        self.renderer.commit()
+
+    def interrupt(self):
+        if self.finished:
+            return
+        for index in range(len(self.valves)):
+            if self.holding[index]:
+                self.valves[index].deactivate()
+                self.holding[index] = False
+        self.finish()
+
+    def finish(self):
+        self.finished = True
+        self.next_step = len(self.valve_steps)
+        if self.on_finished:
+            self.on_finished()
@@ -0,0 +1,48 @@
+"""Where boot time goes, stage by stage, for ``stats:boot``.
+
+pixel_pump.py marks each stage as it finishes: the time in ticks_us and
+``gc.mem_free()`` at that point, into arrays sized once up front so marking
+allocates nothing of its own. After a hard reset ticks_us counts from reset,
+so ``at_us`` is the time since power-on; after a soft reset it does not, and
+``since_start_us`` -- from the first mark -- is the column to compare across
+releases.
+"""
+
+import array
+import gc
+import utime
+
+CAPACITY = 16
+
+
+class BootTimeline:
+    def __init__(self, capacity=CAPACITY):
+        self.names = [None] * capacity
+        self.times_us = array.array("I", [0] * capacity)
+        self.mem_free = array.array("I", [0] * capacity)
+        self.count = 0
+
+    def mark(self, name):
+        """Record that stage ``name`` has just finished. Full means ignored."""
+        index = self.count
+        if index >= len(self.names):
+            return
+        self.times_us[index] = utime.ticks_us()
+        self.mem_free[index] = gc.mem_free()
+        self.names[index] = name
+        self.count = index + 1
+
+    def has(self, name):
+        for index in range(self.count):
+            if self.names[index] == name:
+                return True
+        return False
+
+    def lines(self):
+        """The report ``stats:boot`` prints, one line per stage."""
+        yield "stage,at_us,since_start_us,mem_free"
+        for index in range(self.count):
+            yield (self.names[index]
+                   + "," + str(self.times_us[index])
+                   + "," + str(utime.ticks_diff(self.times_us[index], self.times_us[0]))
+                   + "," + str(self.mem_free[index]))
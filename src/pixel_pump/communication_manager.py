@@ -1,15 +1,28 @@
 import select
+import ujson
 import sys
 import machine
 
 from pixel_pump.enums.power_mode import PowerMode
 from pixel_pump import version
 
+# A pass that takes longer than this delays the next input sample: the
+# scheduler samples every 5 ms.
+DEFAULT_LOOP_BUDGET_US = 5000
+
 
 class CommunicationManager:
     def __init__(self, pixel_pump):
         self.pixel_pump = pixel_pump
         self.settings_manager = self.pixel_pump.settings_manager
+        # Wired up together by pixel_pump.py once the loop is built; stats:*
+        # answers "Unavailable" until then.
+        self.scheduler = None
+        self.render_core = None
+        self.boot_timeline = None
+        self.supervisor = None
+        # MappingTable's store, for mappings:dump and settings:reset.
+        self.mapping_store = None
 
         # setup poll to read USB port
         self.poll_object = select.poll()
@@ -35,6 +48,14 @@ class CommunicationManager:
         if command == "settings":
             self.parse_settings_cmd(arguments)
             return
+
+        if command == "stats":
+            self.parse_stats_cmd(arguments)
+            return
+
+        if command == "mappings":
+            self.parse_mappings_cmd(arguments)
+            return
         
         print("Unknown command '" + command + "'")
     
@@ -57,6 +78,72 @@ class CommunicationManager:
           machine.reset()
 
 
+    def parse_mappings_cmd(self, arguments):
+        if not self.check_has_argument(arguments, 0):
+                return
+        cmd = arguments[0]
+        if cmd == "dump":
+            # Read back from flash, not from the table in RAM: this is how a
+            # host tells a committed row from one only SET.
+            if self.mapping_store is None:
+                print("Unavailable")
+                return
+            print(ujson.dumps(self.mapping_store.rows()))
+            return
+
+    def parse_stats_cmd(self, arguments):
+        if not self.check_has_argument(arguments, 0):
+                return
+        if self.scheduler is None:
+            print("Unavailable")
+            return
+
+        cmd = arguments[0]
+        if cmd == "loop":
+            if len(arguments) > 1 and arguments[1] == "on":
+                budget_us = DEFAULT_LOOP_BUDGET_US
+                if len(arguments) > 2:
+                    if not self.check_valid_int_argument(arguments, 2):
+                        return
+                    budget_us = int(arguments[2])
+                self.scheduler.enable_profiler(budget_us)
+                return
+
+            if len(arguments) > 1 and arguments[1] == "off":
+                self.scheduler.disable_profiler()
+                return
+
+            profiler = self.scheduler.profiler
+            if profiler is None:
+                print("Profiler off")
+                return
+            self.render_core.fold_profile(profiler)
+            for line in profiler.lines():
+                print(line)
+            return
+
+        if cmd == "render":
+            print(self.render_core.stats_line())
+            return
+
+        if cmd == "boot":
+            for line in self.boot_timeline.lines():
+                print(line)
+            return
+
+        if cmd == "stalls":
+            for line in self.supervisor.lines():
+                print(line)
+            return
+
+        if cmd == "reset":
+            if self.scheduler.profiler is not None:
+                self.scheduler.profiler.reset()
+            self.render_core.reset_profile()
+            self.render_core.reset_stats()
+            self.supervisor.reset_records()
+            return
+
     def parse_settings_cmd(self, arguments):
         if not self.check_has_argument(arguments, 0):
                 return
@@ -82,6 +169,8 @@ class CommunicationManager:
         
         if cmd == "reset":
             self.settings_manager.reset_settings()
+            if self.mapping_store is not None:
+                self.mapping_store.save([])
             machine.reset()
         
         if cmd == "set_brightness":
@@ -0,0 +1,86 @@
+import array
+from machine import Pin
+import utime
+
+_RISING = Pin.IRQ_RISING
+_FALLING = Pin.IRQ_FALLING
+
+
+class EdgeCapture:
+    """Input edges captured by ``Pin.irq`` into a preallocated ring buffer.
+
+    The IRQ records ``(pin, level, ticks_us)`` and nothing else -- it runs in
+    hard IRQ context, where allocating is an error. ``drain()`` then hands the
+    edges, oldest first, to whichever control watches that pin, from the main
+    loop. A press is timed at its edge rather than at whichever loop pass
+    happened to poll it, and a glitch shorter than a pass still arrives as a
+    press and a release, however long the rest of the loop stalled for.
+    """
+
+    def __init__(self, size=64):
+        # A power of two, so the indexes wrap with a mask.
+        self._mask = size - 1
+        self._slots = bytearray(size)
+        self._levels = bytearray(size)
+        self._times = array.array("I", [0] * size)
+        # Single producer, single consumer: only the IRQ moves the head and
+        # only drain() moves the tail, so neither needs a lock.
+        self._head = 0
+        self._tail = 0
+        self._pins = []
+        self._consumers = []
+        self.overflows = 0
+        self._overflowed = False
+
+    def watch(self, pin, on_edge):
+        """Capture both edges of ``pin``; ``on_edge(level, ticks_us)`` drains them."""
+        slot = len(self._pins)
+        self._pins.append(pin)
+        self._consumers.append(on_edge)
+        # Bound here, once: looking the method up inside the IRQ would
+        # allocate the bound-method object there.
+        record = self._record
+        pin.irq(handler=lambda p: record(slot, p),
+                trigger=_RISING | _FALLING,
+                hard=True)
+
+    def _record(self, slot, pin):
+        now_us = utime.ticks_us()
+        flags = pin.irq().flags()
+        if (flags & _RISING) and (flags & _FALLING):
+            # Both edges landed before this IRQ ran, i.e. a pulse shorter than
+            # the IRQ latency. The level now says which of them came last.
+            last = pin.value()
+            self._push(slot, 1 - last, now_us)
+            self._push(slot, last, now_us)
+        elif flags & _RISING:
+            self._push(slot, 1, now_us)
+        else:
+            self._push(slot, 0, now_us)
+
+    def _push(self, slot, level, time_us):
+        head = self._head
+        following = (head + 1) & self._mask
+        if following == self._tail:
+            # Full. Dropping the edge desynchronises its control, so drain()
+            # re-reads every pin afterwards rather than trusting the ring.
+            self.overflows += 1
+            self._overflowed = True
+            return
+        self._slots[head] = slot
+        self._levels[head] = level
+        self._times[head] = time_us
+        self._head = following
+
+    def drain(self):
+        tail = self._tail
+        while tail != self._head:
+            self._consumers[self._slots[tail]](self._levels[tail], self._times[tail])
+            tail = (tail + 1) & self._mask
+            self._tail = tail
+
+        if self._overflowed:
+            self._overflowed = False
+            now_us = utime.ticks_us()
+            for slot in range(len(self._pins)):
+                self._consumers[slot](self._pins[slot].value(), now_us)
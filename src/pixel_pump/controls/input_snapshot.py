@@ -0,0 +1,28 @@
+from machine import mem32
+import utime
+
+
+class InputSnapshot:
+    """Every GPIO input level, read once per pass from SIO's GPIO_IN.
+
+    One ``mem32`` read replaces a ``Pin.value()`` call per control, and every
+    control sees the same instant -- so a chord such as LIFT+DROP is either
+    down in a snapshot or it is not, never half-sampled across a pass.
+    Controls pick their bit out with ``1 << pin_number``.
+    """
+
+    def __init__(self, gpio_in):
+        self.gpio_in = gpio_in
+        self.bits = 0
+        self.sampled_us = 0
+        self.sample()
+
+    def sample(self):
+        self.bits = mem32[self.gpio_in]
+        self.sampled_us = utime.ticks_us()
+
+    def level(self, mask):
+        return 1 if self.bits & mask else 0
+
+    def all_set(self, mask):
+        return self.bits & mask == mask
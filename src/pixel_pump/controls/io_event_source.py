@@ -1,12 +1,22 @@
 from machine import Pin
-import utime
 
 from .io_event import IOEvent
+from . import gesture_engine
+
+# The engine's gestures in IOEvent's words, indexed by gesture.
+_EVENTS = (
+    IOEvent.ACTIVATE,
+    IOEvent.DEACTIVATE,
+    IOEvent.HOLD,
+    IOEvent.LONG_HOLD,
+    IOEvent.TAPPED,
+)
 
 class IOEventSource:
-    def __init__(self, title, pin_number, pin_mode, pin_pull, long_hold_threshold=750, tapped_threshold=300, on_event=None, on_tapped=None, on_active=None, on_deactive=None, on_hold=None, on_long_hold=None):
+    def __init__(self, title, pin_number, pin_mode, pin_pull, gestures, long_hold_threshold=750, tapped_threshold=300, on_event=None, on_tapped=None, on_active=None, on_deactive=None, on_hold=None, on_long_hold=None):
         self.title = title
         self.pin = Pin(pin_number, pin_mode, pin_pull)
+        self.pin_mask = 1 << pin_number
         self.long_hold_threshold = long_hold_threshold
         self.tapped_threshold = tapped_threshold
         self.on_tapped = on_tapped
@@ -15,44 +25,30 @@ class IOEventSource:
         self.on_deactive = on_deactive
         self.on_hold = on_hold
         self.on_long_hold = on_long_hold
-        self.pressed = False
-        self.active_start = 0
-
-    def tick(self):
-        state = False
-        state = self.pin.value()
-
-        if state and self.active_start > 0 and (utime.ticks_ms()-self.active_start) > self.long_hold_threshold:
-            self.active_start = 0
-            if self.on_long_hold:
-                self.on_long_hold(self)
-            if self.on_event:
-                self.on_event(self, IOEvent.LONG_HOLD)
-
-        if not state and self.active_start > 0 and (utime.ticks_ms()-self.active_start) > 50 and (utime.ticks_ms()-self.active_start) < self.tapped_threshold:
-            self.active_start = 0
-            if self.on_tapped:
-                self.on_tapped(self)
-            if self.on_event:
-                self.on_event(self, IOEvent.TAPPED)
+        # Same shared GestureEngine as Button.
+        self.gestures = gestures
+        self.slot = gestures.add(self.pin, self.pin_mask, self.on_gesture,
+                                 long_hold_threshold, tapped_threshold)
 
-        if state != self.pressed:
-            self.pressed = state
-            if self.pressed:
-                self.active_start = utime.ticks_ms()
-                if self.on_active:
-                    self.on_active(self)
-                if self.on_event:
-                    self.on_event(self, IOEvent.ACTIVATE)
-            elif not self.pressed:
-                self.active_start = 0
-                if self.on_deactive:
-                    self.on_deactive(self)
-                if self.on_event:
-                    self.on_event(self, IOEvent.DEACTIVATE)
+    @property
+    def pressed(self):
+        return self.gestures.pressed[self.slot] == 1
 
-        if state:
+    def on_gesture(self, gesture, at_us):
+        event = _EVENTS[gesture]
+        if gesture == gesture_engine.DOWN:
+            if self.on_active:
+                self.on_active(self)
+        elif gesture == gesture_engine.UP:
+            if self.on_deactive:
+                self.on_deactive(self)
+        elif gesture == gesture_engine.HOLD:
             if self.on_hold:
                 self.on_hold(self)
-            if self.on_event:
-                self.on_event(self, IOEvent.HOLD)
+        elif gesture == gesture_engine.LONG:
+            if self.on_long_hold:
+                self.on_long_hold(self)
+        elif self.on_tapped:
+            self.on_tapped(self)
+        if self.on_event:
+            self.on_event(self, event, at_us)
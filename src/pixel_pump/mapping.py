@@ -27,6 +27,7 @@ except ImportError:
 
 
 from .enums import Brightness, Colors
+from .mapping_store import ROW_SIZE
 from .usb.protocol import ControlId, EventKind, MappingSlot
 
 
@@ -137,8 +138,6 @@ DEFAULTS = {
     (ControlId.FPEDAL_AUX, Gesture.LONG_HOLD): (Action.SEND_KEY, LEGACY_KEY),
 }
 
-_NO_ACTION = (Action.NONE, 0)
-
 # Holder id for PUMP_TOGGLE in the pump refcount. 0 is not a valid ControlId,
 # so it can never collide with a control holding the trigger.
 _TOGGLE_HOLDER = const(0)
@@ -170,6 +169,17 @@ APPEARANCE_SCAN = (Gesture.TAP, Gesture.LONG_HOLD, Gesture.HELD, Gesture.PRESS)
 
 FACTORY_RESET_HOLD_MS = const(3000)
 
+# MappingTable's cells, and MappingEngine's compiled handlers alongside them,
+# are indexed by (slot, control id, gesture id) directly: ids stay below these
+# spans, so no lookup maps them to dense indexes.
+_CONTROL_SPAN = const(16)
+_GESTURE_SPAN = const(8)
+_CELL_COUNT = const(2 * 16 * 8)
+
+
+def cell_index(slot, control_id, gesture):
+    return (slot * _CONTROL_SPAN + control_id) * _GESTURE_SPAN + gesture
+
 
 def decode_appearance(param):
     """``(animation, color)`` from a FORWARD param, degraded to what PP1 shows.
@@ -191,17 +201,36 @@ def decode_appearance(param):
 class MappingTable:
     """The persisted ``(control, gesture, slot) -> (action, param)`` table.
 
-    Only entries that differ from ``DEFAULTS`` are stored, so ``settings.json``
-    stays small and the defaults can be changed by a firmware update without
-    stale rows pinning the old behaviour.
+    Only entries that differ from ``DEFAULTS`` are stored, in ``store`` (a
+    ``MappingStore``), so the file stays small and the defaults can be changed
+    by a firmware update without stale rows pinning the old behaviour.
+
+    In RAM it is every cell, dense: ``cells`` holds an action byte and a param
+    byte per ``cell_index()``, filled from ``DEFAULTS`` and then patched --
+    fixed in size, and read with index arithmetic alone.
     """
 
-    def __init__(self, settings_manager):
+    def __init__(self, settings_manager, store):
         self.settings_manager = settings_manager
+        self.store = store
         # Bumped on every change so MappingEngine knows to re-evaluate the
-        # remote-mode LEDs without polling the whole table.
+        # remote-mode LEDs without polling the whole table, and which
+        # controls' cells changed since it last looked, one bit per id --
+        # twice over, since its LEDs and its dispatch table catch up apart.
         self.revision = 0
-        self._overrides = {}
+        self.changed_controls = 0
+        self.uncompiled_controls = 0
+        self.cells = bytearray(2 * _CELL_COUNT)
+        # DEFAULTS laid out like ``cells``, for overrides() to compare against.
+        self.default_cells = bytearray(2 * _CELL_COUNT)
+        for key in DEFAULTS:
+            control_id, gesture = key
+            action, param = DEFAULTS[key]
+            for slot in SLOTS:
+                offset = 2 * cell_index(slot, control_id, gesture)
+                self.default_cells[offset] = action
+                self.default_cells[offset + 1] = param
+        self._fill_defaults()
         self._load()
 
     # -- USBManager contract ------------------------------------------------
@@ -226,51 +255,89 @@ class MappingTable:
 
     def get(self, control_id, gesture, slot):
         """Host-facing read: the SEND_KEY sentinel is resolved to a keycode."""
-        action, param = self.get_raw(control_id, gesture, slot)
-        if action == Action.SEND_KEY and self._is_legacy_key(control_id, param):
-            param = self.legacy_key(gesture)[1]
-        return (action, param)
+        offset = 2 * cell_index(slot, control_id, gesture)
+        return (self.cells[offset], self._host_param(control_id, gesture, offset))
 
     def set(self, control_id, gesture, slot, action, param):
         """RAM only -- ``commit()`` is what reaches flash."""
-        key = (control_id, slot, gesture)
-        if (action, param) == DEFAULTS.get((control_id, gesture), _NO_ACTION):
-            self._overrides.pop(key, None)
-        else:
-            self._overrides[key] = (action, param)
+        offset = 2 * cell_index(slot, control_id, gesture)
+        self.cells[offset] = action
+        self.cells[offset + 1] = param
+        self.changed_controls |= 1 << control_id
+        self.uncompiled_controls |= 1 << control_id
         self.revision += 1
 
-    def entries(self):
-        rows = []
-        for control_id in CONTROLS:
-            for slot in SLOTS:
-                for gesture in GESTURES:
-                    action, param = self.get(control_id, gesture, slot)
-                    if action != Action.NONE:
-                        rows.append((control_id, slot, gesture, action, param))
-        return rows
+    def set_rows(self, rows, count):
+        """``set()`` for each of ``count`` already-validated rows, in order,
+        as one change: a batch bumps ``revision`` once, so it repaints once."""
+        cells = self.cells
+        changed = 0
+        for offset in range(0, ROW_SIZE * count, ROW_SIZE):
+            control_id = rows[offset]
+            cell = 2 * cell_index(rows[offset + 1], control_id, rows[offset + 2])
+            cells[cell] = rows[offset + 3]
+            cells[cell + 1] = rows[offset + 4]
+            changed |= 1 << control_id
+        self.changed_controls |= changed
+        self.uncompiled_controls |= changed
+        self.revision += 1
+
+    def next_entry(self, position):
+        """The bulk dump's cursor: positions run over every control, slot and
+        gesture in that order, and NONE cells are skipped."""
+        per_control = len(SLOTS) * len(GESTURES)
+        end = len(CONTROLS) * per_control
+        while position < end:
+            control_id = CONTROLS[position // per_control]
+            slot = SLOTS[(position // len(GESTURES)) % len(SLOTS)]
+            gesture = GESTURES[position % len(GESTURES)]
+            position += 1
+            offset = 2 * cell_index(slot, control_id, gesture)
+            action = self.cells[offset]
+            if action != Action.NONE:
+                param = self._host_param(control_id, gesture, offset)
+                return (position, control_id, slot, gesture, action, param)
+        return None
 
     def reset(self):
-        self._overrides = {}
+        self._fill_defaults()
         self.revision += 1
-        return self.settings_manager.set_mappings([])
+        return self.store.save([])
 
     def commit(self):
+        return self.store.save(self.overrides())
+
+    def overrides(self):
+        """``[control, slot, gesture, action, param]`` for every cell that
+        differs from ``DEFAULTS`` -- what is persisted."""
         rows = []
-        for key in self._overrides:
-            control_id, slot, gesture = key
-            action, param = self._overrides[key]
-            rows.append([control_id, slot, gesture, action, param])
-        return self.settings_manager.set_mappings(rows)
+        cells = self.cells
+        defaults = self.default_cells
+        for control_id in CONTROLS:
+            for slot in SLOTS:
+                for gesture in GESTURES:
+                    offset = 2 * cell_index(slot, control_id, gesture)
+                    if (cells[offset] != defaults[offset]
+                            or cells[offset + 1] != defaults[offset + 1]):
+                        rows.append([control_id, slot, gesture, cells[offset], cells[offset + 1]])
+        return rows
 
     # -- local use ----------------------------------------------------------
 
     def get_raw(self, control_id, gesture, slot):
-        """Read as stored -- the SEND_KEY sentinel stays a sentinel."""
-        entry = self._overrides.get((control_id, slot, gesture), None)
-        if entry is not None:
-            return entry
-        return DEFAULTS.get((control_id, gesture), _NO_ACTION)
+        """Read as stored -- the SEND_KEY sentinel stays a sentinel.
+
+        Builds a tuple; per-event and per-repaint paths index ``cells`` at
+        ``2 * cell_index()`` instead.
+        """
+        offset = 2 * cell_index(slot, control_id, gesture)
+        return (self.cells[offset], self.cells[offset + 1])
+
+    def _host_param(self, control_id, gesture, offset):
+        param = self.cells[offset + 1]
+        if self.cells[offset] == Action.SEND_KEY and self._is_legacy_key(control_id, param):
+            return self.legacy_key(gesture)[1]
+        return param
 
     def legacy_key(self, gesture):
         """The aux pedal's stdin-configured ``(modifier, keycode)``."""
@@ -294,25 +361,50 @@ class MappingTable:
     def _is_legacy_key(self, control_id, param):
         return control_id == ControlId.FPEDAL_AUX and param == LEGACY_KEY
 
+    def _fill_defaults(self):
+        self.changed_controls = (1 << _CONTROL_SPAN) - 1
+        self.uncompiled_controls = self.changed_controls
+        cells = self.cells
+        defaults = self.default_cells
+        for offset in range(len(cells)):
+            cells[offset] = defaults[offset]
+
     def _load(self):
-        rows = self.settings_manager.get_mappings()
-        if not isinstance(rows, list):
+        # Rows still in settings.json predate the store: they win once, are
+        # moved across, and only then leave settings.json, so a power cut
+        # during the move loses nothing.
+        legacy = self.settings_manager.get_legacy_mappings()
+        if legacy is not None:
+            if isinstance(legacy, list):
+                for row in legacy:
+                    try:
+                        control_id, slot, gesture, action, param = row
+                    except (TypeError, ValueError):
+                        continue  # corrupt row -- fall back to the default for it
+                    self._load_row(control_id, slot, gesture, action, param)
+            if self.store.save(self.overrides()):
+                self.settings_manager.drop_legacy_mappings()
             return
 
-        for row in rows:
-            try:
-                control_id, slot, gesture, action, param = row
-            except (TypeError, ValueError):
-                continue  # corrupt row -- fall back to the default for it
-            if not self.has_control(control_id):
-                continue
-            if slot not in SLOTS:
-                continue
-            if not self.has_gesture(control_id, gesture):
-                continue
-            if not self.is_valid_action(control_id, gesture, action, param):
-                continue
-            self.set(control_id, gesture, slot, action, param)
+        rows = self.store.load()
+        if not rows:
+            return
+        for offset in range(0, len(rows), ROW_SIZE):
+            self._load_row(rows[offset], rows[offset + 1], rows[offset + 2],
+                           rows[offset + 3], rows[offset + 4])
+
+    def _load_row(self, control_id, slot, gesture, action, param):
+        if not self.has_control(control_id):
+            return
+        if slot not in SLOTS:
+            return
+        if not self.has_gesture(control_id, gesture):
+            return
+        if not self.is_valid_action(control_id, gesture, action, param):
+            return
+        if not isinstance(param, int) or not 0 <= param <= 0xFF:
+            return
+        self.set(control_id, gesture, slot, action, param)
 
 
 class MappingEngine:
@@ -325,12 +417,14 @@ class MappingEngine:
     mid-pick.
     """
 
-    def __init__(self, table, state_machine, keyboard, buttons, is_host_active):
+    def __init__(self, table, state_machine, keyboard, buttons, is_host_active,
+                 renderer=None, repaint_interval_ms=0):
         self.table = table
         self.state_machine = state_machine
         self.keyboard = keyboard
         self.buttons = buttons
         self.is_host_active = is_host_active
+        self.renderer = renderer
 
         self._pump_holders = set()
         self._held = {}
@@ -338,6 +432,39 @@ class MappingEngine:
         self._last_slot = None
         self._last_revision = None
         self._last_suspended = None
+        # Each button's appearance per slot, kept until a cell of that button
+        # changes, so an edit rescans one control rather than all of them.
+        # Table edits repaint at most once per ``repaint_interval_ms`` -- a
+        # frame -- however many a host sends in between.
+        self._appearances = [None] * (len(SLOTS) * _CONTROL_SPAN)
+        self._appearance_known = bytearray(len(SLOTS) * _CONTROL_SPAN)
+        self.repaint_interval_ms = repaint_interval_ms
+        self._repainted_ms = None
+        self._repaint_pending = False
+        # LED bit masks: the LEDs of the buttons a connected host owns, which
+        # it may stream pixels to, and the ones it currently does.
+        self._stream_owned = 0
+        self._streamed = 0
+
+        # The table compiled for dispatch: per table cell, the handler that
+        # performs its action locally bound to the cell's param, as
+        # ``(performer, param)`` (None for NONE and FORWARD). Only the cells
+        # of controls changed since are recompiled, on the next press, so a
+        # press is an index and a call and an edit costs its control's cells.
+        self._performers = {
+            Action.MODE_LIFT: lambda control_id, gesture, param: self.state_machine.state.to_lift(),
+            Action.MODE_DROP: lambda control_id, gesture, param: self.state_machine.state.to_drop(),
+            Action.MODE_REVERSE: lambda control_id, gesture, param: self.state_machine.state.to_reverse(),
+            Action.POWER_LOW: lambda control_id, gesture, param: self.state_machine.state.to_power_low(),
+            Action.POWER_HIGH: lambda control_id, gesture, param: self.state_machine.state.to_power_high(),
+            Action.BRIGHTNESS_MENU: lambda control_id, gesture, param: self.state_machine.state.to_brightness_settings(),
+            Action.POWER_SETTINGS_LOW: lambda control_id, gesture, param: self.state_machine.state.to_low_power_settings(),
+            Action.POWER_SETTINGS_HIGH: lambda control_id, gesture, param: self.state_machine.state.to_high_power_settings(),
+            Action.SEND_KEY: self._send_key,
+            Action.PUMP_TOGGLE: lambda control_id, gesture, param: self._pump_toggle(),
+            Action.VENT_PULSE: self._vent_pulse,
+        }
+        self._handlers = [None] * _CELL_COUNT
 
     # -- slot resolution ----------------------------------------------------
 
@@ -349,6 +476,33 @@ class MappingEngine:
     def resolve(self, control_id, gesture):
         return self.table.get_raw(control_id, gesture, self.active_slot())
 
+    def _compile(self):
+        table = self.table
+        pending = table.uncompiled_controls
+        table.uncompiled_controls = 0
+        cells = table.cells
+        performers = self._performers
+        handlers = self._handlers
+        for control_id in range(_CONTROL_SPAN):
+            if not (pending >> control_id) & 1:
+                continue
+            for slot in SLOTS:
+                first = cell_index(slot, control_id, 0)
+                for index in range(first, first + _GESTURE_SPAN):
+                    # PUMP_TRIGGER has no handler: it only acts through HELD's
+                    # press and release, which is_valid_action() enforces.
+                    performer = performers.get(cells[2 * index], None)
+                    if performer is None:
+                        handlers[index] = None
+                    else:
+                        handlers[index] = (performer, cells[2 * index + 1])
+
+    def _compiled(self, control_id, gesture):
+        """The index of ``(active slot, control, gesture)``, compiled afresh."""
+        if self.table.uncompiled_controls:
+            self._compile()
+        return cell_index(self.active_slot(), control_id, gesture)
+
     # -- event dispatch -----------------------------------------------------
 
     def dispatch(self, control_id, event_kind):
@@ -395,7 +549,10 @@ class MappingEngine:
             self.keyboard.release()
 
     def _press_held(self, control_id):
-        action, param = self.resolve(control_id, Gesture.HELD)
+        index = self._compiled(control_id, Gesture.HELD)
+        cells = self.table.cells
+        action = cells[2 * index]
+        param = cells[2 * index + 1]
         if action == Action.NONE or action == Action.FORWARD:
             return
 
@@ -410,45 +567,24 @@ class MappingEngine:
             )
             self.keyboard.press(modifier, keycode)
         else:
-            self._perform(control_id, Gesture.HELD, action, param)
+            performer, param = self._handlers[index]
+            performer(control_id, Gesture.HELD, param)
 
     def _fire(self, control_id, gesture):
-        action, param = self.resolve(control_id, gesture)
-        self._perform(control_id, gesture, action, param)
+        # NONE and FORWARD have no handler, and no local behaviour by
+        # definition -- FORWARD's EVENT frame already went out under the
+        # publish-all rule.
+        handler = self._handlers[self._compiled(control_id, gesture)]
+        if handler is not None:
+            performer, param = handler
+            performer(control_id, gesture, param)
 
-    def _perform(self, control_id, gesture, action, param):
-        # NONE and FORWARD have no local behaviour by definition -- FORWARD's
-        # EVENT frame already went out under the publish-all rule.
-        if action == Action.NONE or action == Action.FORWARD:
-            return
+    def _send_key(self, control_id, gesture, param):
+        modifier, keycode = self.table.send_key_args(control_id, gesture, param)
+        self.keyboard.tap(modifier, keycode)
 
-        state = self.state_machine.state
-
-        if action == Action.MODE_LIFT:
-            state.to_lift()
-        elif action == Action.MODE_DROP:
-            state.to_drop()
-        elif action == Action.MODE_REVERSE:
-            state.to_reverse()
-        elif action == Action.POWER_LOW:
-            state.to_power_low()
-        elif action == Action.POWER_HIGH:
-            state.to_power_high()
-        elif action == Action.BRIGHTNESS_MENU:
-            state.to_brightness_settings()
-        elif action == Action.POWER_SETTINGS_LOW:
-            state.to_low_power_settings()
-        elif action == Action.POWER_SETTINGS_HIGH:
-            state.to_high_power_settings()
-        elif action == Action.SEND_KEY:
-            modifier, keycode = self.table.send_key_args(control_id, gesture, param)
-            self.keyboard.tap(modifier, keycode)
-        elif action == Action.PUMP_TOGGLE:
-            self._pump_toggle()
-        elif action == Action.VENT_PULSE:
-            state.vent_pulse(param * 10 if param else VENT_PULSE_DEFAULT_MS)
-        # PUMP_TRIGGER only reaches here on a gesture with no release edge,
-        # which is_valid_action() rejects. Ignore rather than latch the pump on.
+    def _vent_pulse(self, control_id, gesture, param):
+        self.state_machine.state.vent_pulse(param * 10 if param else VENT_PULSE_DEFAULT_MS)
 
     # -- pump refcount ------------------------------------------------------
 
@@ -479,17 +615,34 @@ class MappingEngine:
         slot = self.active_slot()
         revision = self.table.revision
         suspended = self.state_machine.state.suspends_mapping
-        if (slot == self._last_slot
-                and revision == self._last_revision
-                and suspended == self._last_suspended):
-            return
+        if revision != self._last_revision:
+            self._last_revision = revision
+            changed = self.table.changed_controls
+            self.table.changed_controls = 0
+            for control_id in self.buttons:
+                if (changed >> control_id) & 1:
+                    for each_slot in SLOTS:
+                        self._appearance_known[each_slot * _CONTROL_SPAN + control_id] = 0
+            self._repaint_pending = True
+
+        now_ms = utime.ticks_ms()
+        if slot == self._last_slot and suspended == self._last_suspended:
+            # Only the table moved: wait out the rest of the frame, so a burst
+            # of SET_MAPPINGs repaints once. A slot or menu change is at once.
+            if not self._repaint_pending:
+                return
+            if (self._repainted_ms is not None
+                    and utime.ticks_diff(now_ms, self._repainted_ms) < self.repaint_interval_ms):
+                return
 
         self._last_slot = slot
-        self._last_revision = revision
         self._last_suspended = suspended
+        self._repaint_pending = False
+        self._repainted_ms = now_ms
         self._apply_remote_leds(slot, suspended)
 
     def _apply_remote_leds(self, slot, suspended):
+        owned = 0
         for control_id in self.buttons:
             button = self.buttons[control_id]
             # Nothing is host-owned while a settings menu is up: the engine is
@@ -498,7 +651,7 @@ class MappingEngine:
             if suspended:
                 appearance = None
             else:
-                appearance = self._remote_appearance(control_id, slot)
+                appearance = self._cached_appearance(control_id, slot)
             current = self._remote_leds.get(control_id, None)
 
             if appearance is None:
@@ -518,6 +671,36 @@ class MappingEngine:
                 # underneath keeps tracking the state machine.
                 self._remote_leds[control_id] = appearance
                 self._render_appearance(button, appearance)
+            if appearance is not None and slot == MappingSlot.CONNECTED:
+                owned |= (1 << button.left_led_index) | (1 << button.right_led_index)
+
+        # A button the host no longer owns stops showing its stream, and
+        # shows its badge -- or the state machine's colour -- again.
+        self._stream_owned = owned
+        if self._streamed & ~owned:
+            self._streamed &= owned
+            self.renderer.post_stream(self._streamed)
+
+    def stream_leds(self, rgb, written):
+        """Show a host-streamed LED frame; returns the LEDs it reached.
+
+        ``rgb`` holds three bytes per LED index and ``written`` marks the LEDs
+        the host sent. Only the LEDs of buttons it owns take them; an owned
+        LED the frame leaves out goes back to the button's badge.
+        """
+        if self.renderer is None:
+            return 0
+        shown = written & self._stream_owned
+        self._streamed = shown
+        self.renderer.post_stream(shown, rgb)
+        return shown
+
+    def _cached_appearance(self, control_id, slot):
+        index = slot * _CONTROL_SPAN + control_id
+        if not self._appearance_known[index]:
+            self._appearances[index] = self._remote_appearance(control_id, slot)
+            self._appearance_known[index] = 1
+        return self._appearances[index]
 
     def _remote_appearance(self, control_id, slot):
         """The button's appearance in ``slot``, or None to leave it alone.
@@ -539,12 +722,14 @@ class MappingEngine:
         forwards = False
         local = False
         param = 0
+        cells = self.table.cells
         for gesture in APPEARANCE_SCAN:
-            action, cell_param = self.table.get_raw(control_id, gesture, slot)
+            offset = 2 * cell_index(slot, control_id, gesture)
+            action = cells[offset]
             if action == Action.FORWARD:
                 forwards = True
                 if param == 0:
-                    param = cell_param
+                    param = cells[offset + 1]
             elif action != Action.NONE:
                 local = True
         if not forwards:
@@ -571,19 +756,23 @@ class MappingEngine:
             button.set_color(rgb, REMOTE_BRIGHTNESS, override=True)
 
 
-def check_factory_reset(table, renderer, pins, hold_ms=FACTORY_RESET_HOLD_MS):
+def check_factory_reset(table, renderer, snapshot, mask, hold_ms=FACTORY_RESET_HOLD_MS):
     """LIFT + DROP held at power-on restores the default mapping table.
 
     The escape hatch exists because a host can map every button to FORWARD,
     which leaves a pump with no local way back. Runs before the boot sequence
-    and costs nothing unless both pins are already down.
+    and costs nothing unless both pins are already down. ``mask`` holds the
+    chord's pins in ``snapshot`` (an InputSnapshot), so both are read in the
+    same instant every time.
     """
-    if not _all_held(pins):
+    snapshot.sample()
+    if not snapshot.all_set(mask):
         return False
 
     started_ms = utime.ticks_ms()
     while utime.ticks_diff(utime.ticks_ms(), started_ms) < hold_ms:
-        if not _all_held(pins):
+        snapshot.sample()
+        if not snapshot.all_set(mask):
             return False
         utime.sleep_ms(10)
 
@@ -592,21 +781,16 @@ def check_factory_reset(table, renderer, pins, hold_ms=FACTORY_RESET_HOLD_MS):
     return True
 
 
-def _all_held(pins):
-    for pin in pins:
-        if not pin.value():
-            return False
-    return True
-
-
 def _flash_confirm(renderer, times=3, on_ms=120, off_ms=120):
-    # The UI timer is not running yet at this point, so flush by hand.
+    # The render core is not running yet at this point, so flush by hand.
     for _ in range(times):
         for index in range(renderer.led_count):
             renderer.set_led_color(index, Colors.WHITE, Brightness.DEFAULT)
+        renderer.commit()
         renderer.flush_frame_buffer()
         utime.sleep_ms(on_ms)
         for index in range(renderer.led_count):
             renderer.set_led_color(index, Colors.NONE, 0.0)
+        renderer.commit()
         renderer.flush_frame_buffer()
         utime.sleep_ms(off_ms)
@@ -0,0 +1,114 @@
+"""The mapping table's overrides on flash, in a file of their own.
+
+Kept out of ``settings.json`` so that COMMIT_MAPPINGS writes the rows and
+nothing else, and so boot reads them without going through JSON. Layout,
+little-endian::
+
+    0   4  magic, b"PPMT"
+    4   1  VERSION
+    5   1  row size, ROW_SIZE
+    6   2  row count
+    8   2  CRC-16/CCITT-FALSE of the rows
+    10  .. rows: control, slot, gesture, action, param -- a byte each
+
+At most every cell of the table is a row (16 controls, 2 slots, 8 gestures),
+so the file never grows past a couple of kilobytes.
+"""
+
+import os
+
+MAGIC = b"PPMT"
+VERSION = 1
+ROW_SIZE = 5
+HEADER_SIZE = 10
+
+
+def crc16(data, start=0, end=None):
+    """CRC-16/CCITT-FALSE over ``data[start:end]``, without slicing it."""
+    if end is None:
+        end = len(data)
+    crc = 0xFFFF
+    for index in range(start, end):
+        crc ^= data[index] << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+class MappingStore:
+    """Reads and writes the override rows; ``MappingTable`` decides what they are.
+
+    ``save()`` writes a temporary file and renames it over the old one, so a
+    power cut mid-commit leaves the previous table rather than half of the new
+    one. ``load()`` is a single read of the whole file.
+    """
+
+    def __init__(self, file_name="mappings.bin"):
+        self.file_name = file_name
+        self.temp_name = file_name + ".tmp"
+
+    def load(self):
+        """The rows as one buffer of ``ROW_SIZE``-byte records.
+
+        None if there is no file yet. A file that fails its header or CRC reads
+        as no rows -- every cell falls back to its default.
+        """
+        try:
+            with open(self.file_name, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        if len(data) < HEADER_SIZE or data[0:4] != MAGIC:
+            print("mapping store unreadable")
+            return b""
+        if data[4] != VERSION or data[5] != ROW_SIZE:
+            print("mapping store version " + str(data[4]) + " not supported")
+            return b""
+        end = HEADER_SIZE + ROW_SIZE * (data[6] | data[7] << 8)
+        if end != len(data) or crc16(data, HEADER_SIZE, end) != data[8] | data[9] << 8:
+            print("mapping store corrupt")
+            return b""
+        return memoryview(data)[HEADER_SIZE:]
+
+    def save(self, rows):
+        """Write ``rows``, each ``[control, slot, gesture, action, param]``.
+
+        True once the new file is in place, False if flash refused it.
+        """
+        count = len(rows)
+        data = bytearray(HEADER_SIZE + ROW_SIZE * count)
+        data[0:4] = MAGIC
+        data[4] = VERSION
+        data[5] = ROW_SIZE
+        data[6] = count & 0xFF
+        data[7] = count >> 8
+        offset = HEADER_SIZE
+        for row in rows:
+            for field in row:
+                data[offset] = field
+                offset += 1
+        crc = crc16(data, HEADER_SIZE)
+        data[8] = crc & 0xFF
+        data[9] = crc >> 8
+
+        try:
+            with open(self.temp_name, "wb") as file:
+                file.write(data)
+            os.rename(self.temp_name, self.file_name)
+        except OSError:
+            print("error writing the mapping store")
+            return False
+
+        return True
+
+    def rows(self):
+        """What is on flash right now, as lists -- for ``mappings:dump``."""
+        data = self.load()
+        if not data:
+            return []
+        return [list(data[offset:offset + ROW_SIZE])
+                for offset in range(0, len(data), ROW_SIZE)]
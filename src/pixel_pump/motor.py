@@ -10,6 +10,9 @@ class Motor:
         self.on_timeout = on_timeout
         self.turned_on_at = 0
         self.timeout = timeout
+        # What the PWM peripheral was last given, so tick() only has work --
+        # and the scheduler only wakes for it -- when that has to change.
+        self.applied_duty = None
 
     def start(self, duty=None):
         if duty:
@@ -23,12 +26,26 @@ class Motor:
     def set_pwm(self, duty):
         self.pwm_duty = duty
 
+    def target_duty(self):
+        if self.running:
+            return self.pwm_duty * self.pwm_duty
+        return 0
+
+    def next_deadline(self):
+        if self.target_duty() != self.applied_duty:
+            return utime.ticks_ms()
+        if self.running:
+            return utime.ticks_add(self.turned_on_at, self.timeout + 1)
+        return None
+
     def tick(self):
         if self.running:
-            if utime.ticks_ms() - self.turned_on_at > self.timeout:
+            if utime.ticks_diff(utime.ticks_ms(), self.turned_on_at) > self.timeout:
                 self.stop()
                 if self.on_timeout:
                     self.on_timeout(self)
-            self.pwm.duty_u16(self.pwm_duty * self.pwm_duty)
-        else:
-            self.pwm.duty_u16(0)
+
+        duty = self.target_duty()
+        if duty != self.applied_duty:
+            self.pwm.duty_u16(duty)
+            self.applied_duty = duty
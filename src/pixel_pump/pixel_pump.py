@@ -1,29 +1,47 @@
+# Timed first, so the rest of the imports show up as a stage of their own.
+from .boot_timeline import BootTimeline
+boot_timeline = BootTimeline()
+boot_timeline.mark('start')
+
 import machine
-from machine import Pin, PWM, mem32, Timer
+from machine import Pin, PWM, mem32
+import micropython
+import rp2
 import utime
 
 from .controls.button import Button
 from .controls.button_event import ButtonEvent
 from .controls.io_event_source import IOEventSource
 from .controls.io_event import IOEvent
+from .controls.edge_capture import EdgeCapture
+from .controls.gesture_engine import GestureEngine
+from .controls.input_snapshot import InputSnapshot
 from .mapping import MappingEngine, MappingTable, check_factory_reset
+from .mapping_store import MappingStore
 from .pixel_pump_state_machine import PixelPumpStateMachine
 from .settings_manager import SettingsManager
 from .valve import Valve
-from .boot_sequence import run_boot_sequence
+from .boot_sequence import BootSequence
 from .motor import Motor
 from .communication_manager import CommunicationManager
 from .ui_renderer import UIRenderer
+from .scheduler import Scheduler
+from .supervisor import Supervisor
+from .render_core import RenderCore, Spinlock
 from .usb.protocol import ControlId, EventKind
 from .usb.usb_manager import USBManager
 
+boot_timeline.mark('imports')
+
 # Register Base Addresses
 
 SYSCFG_BASE         = 0x40004000
 IO_BANK0_BASE       = 0x40014000
+WATCHDOG_BASE       = 0x40058000
 PADS_BANK0_BASE     = 0x4001C000
 PADS_QSPI_BASE      = 0x40020000
 DMA_BASE            = 0x50000000
+PIO0_BASE           = 0x50200000
 SIO_BASE            = 0xD0000000
 
 # GPIO control
@@ -155,6 +173,7 @@ DMA_TRIGGER         = DMA_BASE + 0x0C # Add (channel * 0x40)
 
 DMA_CHAN_MPY        = 0x40
 
+DMA_BUSY_BIT        = 24 # Read only
 DMA_IRQ_QUIET_BIT   = 21
 DMA_TREQ_SEL_BITS   = 15
 DMA_CHAIN_TO_BITS   = 11
@@ -174,12 +193,55 @@ DMA_TREQ_COPY_VAL   = DMA_TREQ_AUTO_VAL # Immediately run
 DMA_TREQ_GET_VAL    = DMA_TREQ_RX_VAL   # Get from PIO
 DMA_TREQ_PUT_VAL    = DMA_TREQ_TX_VAL   # Put to PIO
 
+DMA_SIZE_WORD_VAL   = 2
+
+# PIO
+
+PIO0_TXF            = PIO0_BASE + 0x010 # Add (state machine * 4)
+PIO_TXF_MPY         = 4
+
+# Watchdog
+
+WATCHDOG_CTRL       = WATCHDOG_BASE + 0x00
+WATCHDOG_REASON     = WATCHDOG_BASE + 0x08 # Why the last reset: 1=Timer, 2=Force
+WATCHDOG_SCRATCH    = WATCHDOG_BASE + 0x0C # Add (n * 4), kept across a watchdog reset
+WATCHDOG_SCRATCH_MPY = 4
+
 machine.freq(96000000)
+boot_timeline.mark('freq')
 
 motor = Motor(motorPin=5)
 
-# The UI Renderer class holds the frame buffer and the PIO state machine
-renderer = UIRenderer()
+# The LED chain is fed by DMA from PIO0's state machine 0 TX FIFO, paced by
+# its DREQ. The channel is claimed through rp2.DMA so nothing else in
+# MicroPython is handed the same one, then programmed through the map above.
+LED_STATE_MACHINE = 0
+led_dma = rp2.DMA()
+LED_DMA_CHANNEL = DMA_CHAN_MPY * led_dma.channel
+mem32[DMA_WR_ADDRESS + LED_DMA_CHANNEL] = PIO0_TXF + PIO_TXF_MPY * LED_STATE_MACHINE
+
+# Guards the animation engine's posted record to the render core
+# (render_core.py). Taken from the top of the claim-free range, 24-31, that
+# pico-sdk hands out from the bottom -- and not 31 itself, whose claimed value
+# (1 << 31) would not fit a small int and would allocate on every claim.
+RENDER_SPINLOCK = 29
+render_lock = Spinlock(SPINLOCK + SPINLOCK_MPY * RENDER_SPINLOCK)
+
+# The UI Renderer class holds the frame buffer, the LED animation engine and
+# the PIO state machine
+renderer = UIRenderer(
+    dma_read_address=DMA_RD_ADDRESS + LED_DMA_CHANNEL,
+    dma_trigger=DMA_TRIGGER + LED_DMA_CHANNEL,
+    dma_ctrl=(1 << DMA_IRQ_QUIET_BIT)
+             | ((DMA_TREQ_PUT_VAL + LED_STATE_MACHINE) << DMA_TREQ_SEL_BITS)
+             # Chained to itself, which is how a channel says "no chain".
+             | (led_dma.channel << DMA_CHAIN_TO_BITS)
+             | (1 << DMA_INCR_READ_BIT)
+             | (DMA_SIZE_WORD_VAL << DMA_DATA_SIZE_BITS)
+             | (1 << DMA_ENABLE_BIT),
+    dma_busy_mask=1 << DMA_BUSY_BIT,
+    lock=render_lock)
+mem32[DMA_COUNT + LED_DMA_CHANNEL] = renderer.led_count
 
 def SetPadQSPI(pin, d, s):
     adr = PAD_QSPI + PAD_QSPI_MPY * pin
@@ -201,14 +263,41 @@ for pin in range(6):
 # down -- settings.json is parsed once, and USB can never enumerate on a
 # different view of it than the rest of the firmware runs on.
 settings_manager = SettingsManager()
+boot_timeline.mark('settings')
 
-# USB is initialized once, here, so the host has finished enumerating the
-# composite keyboard + vendor HID device by the time the boot sequence ends.
+# USB is initialized once, here, so the host is enumerating the composite
+# keyboard + vendor HID device while the rest of the firmware comes up.
 # builtin_driver keeps the CDC interface, which CommunicationManager reads the
 # legacy stdin protocol from.
+def _on_usb_data_connection_changed(manager, connected):
+    # A host opening an interface is the first the firmware sees of
+    # enumeration having finished.
+    if connected and not boot_timeline.has('usb_enumerated'):
+        boot_timeline.mark('usb_enumerated')
+
+
+# Time to first input, and the end of the timeline: the first button, pedal or
+# host command the firmware actually services, whichever comes first.
+_first_input_pending = True
+
+
+def _mark_first_input():
+    global _first_input_pending
+    if _first_input_pending:
+        _first_input_pending = False
+        boot_timeline.mark('first_input')
+
+
+def _on_usb_command_received(manager, command_id):
+    _mark_first_input()
+
+
 usb_manager = USBManager(
-    keyboard_enabled=settings_manager.get_keyboard_enabled(), debug=False
+    keyboard_enabled=settings_manager.get_keyboard_enabled(), debug=False,
+    on_usb_data_connection_changed=_on_usb_data_connection_changed,
+    on_command_received=_on_usb_command_received
 )
+boot_timeline.mark('usb_init')
 
 def _button_event_to_usb_event_kind(event):
     if event == ButtonEvent.TOUCH_DOWN:
@@ -259,13 +348,16 @@ def _legacy_button_dispatch(btn, event):
         mapping_engine.release_held(_CONTROL_IDS_BY_BUTTON.get(btn))
 
 
-def on_button_event(btn, event):
+def on_button_event(btn, event, at_us=None):
+    _mark_first_input()
+    boot_sequence.interrupt()
+
     # Publish-all: every control is reported to an active host, whatever it
     # does locally.
     control_id = _CONTROL_IDS_BY_BUTTON.get(btn)
     event_kind = _button_event_to_usb_event_kind(event)
     if control_id is not None and event_kind is not None:
-        usb_manager.publish_event(control_id, event_kind)
+        usb_manager.publish_event(control_id, event_kind, at_us=at_us)
 
     if pixel_pump.state.suspends_mapping:
         _legacy_button_dispatch(btn, event)
@@ -275,31 +367,43 @@ def on_button_event(btn, event):
         mapping_engine.dispatch(control_id, event_kind)
 
 
-def on_foot_pedal_event(source, event):
+def on_foot_pedal_event(source, event, at_us=None):
     # The pedal has no LEDs of its own; the trigger button's pulsate/solid
     # feedback follows because both controls funnel into the same state
     # intents.
+    _mark_first_input()
+    boot_sequence.interrupt()
     event_kind = _io_event_to_usb_event_kind(event)
     if event_kind is not None:
-        usb_manager.publish_event(ControlId.FPEDAL, event_kind)
+        usb_manager.publish_event(ControlId.FPEDAL, event_kind, at_us=at_us)
         mapping_engine.dispatch(ControlId.FPEDAL, event_kind)
 
 
-def on_aux_pedal_event(source, event):
+def on_aux_pedal_event(source, event, at_us=None):
     # https://deskthority.net/wiki/Scancode for keyboard codes -- the pedal's
     # legacy key and modifier still come from settings.json, reached through
     # the SEND_KEY sentinel in the default table.
+    _mark_first_input()
+    boot_sequence.interrupt()
     event_kind = _io_event_to_usb_event_kind(event)
     if event_kind is not None:
-        usb_manager.publish_event(ControlId.FPEDAL_AUX, event_kind)
+        usb_manager.publish_event(ControlId.FPEDAL_AUX, event_kind, at_us=at_us)
         mapping_engine.dispatch(ControlId.FPEDAL_AUX, event_kind)
 
-def renderBtn(btn):
-    global renderer
-    renderer.set_led_color(
-        btn.left_led_index, (btn.left_color[0], btn.left_color[1], btn.left_color[2]), btn.left_color[3])
-    renderer.set_led_color(
-        btn.right_led_index, (btn.right_color[0], btn.right_color[1], btn.right_color[2]), btn.right_color[3])
+# The buttons and pedals take their edges from Pin.irq rather than from a
+# poll, so a press is timed at the edge and is not lost while the loop is
+# stalled in a flash write or a bulk USB dump. An exception raised in that
+# hard IRQ needs this buffer to be reported at all.
+micropython.alloc_emergency_exception_buf(100)
+edge_capture = EdgeCapture()
+
+# ...and read their levels from one GPIO_IN snapshot per pass, so every
+# control is sampled at the same instant and a chord is never half-seen.
+input_snapshot = InputSnapshot(GPIO_IN)
+
+# Both feed one debouncing gesture engine, which every button and pedal
+# registers with and which runs them all in a single pass.
+gestures = GestureEngine(edge_capture=edge_capture, input_snapshot=input_snapshot)
 
 
 lift_button = Button(title='Lift',
@@ -307,42 +411,48 @@ lift_button = Button(title='Lift',
                      right_led_index=1,
                      switch_pin=8,
                      on_button_event=on_button_event,
-                     on_should_render=renderBtn)
+                     renderer=renderer,
+                     gestures=gestures)
 
 drop_button = Button(title='Drop',
                      left_led_index=2,
                      right_led_index=3,
                      switch_pin=9,
                      on_button_event=on_button_event,
-                     on_should_render=renderBtn)
+                     renderer=renderer,
+                     gestures=gestures)
 
 low_button = Button(title='Low',
                     left_led_index=4,
                     right_led_index=5,
                     switch_pin=11,
                     on_button_event=on_button_event,
-                    on_should_render=renderBtn)
+                    renderer=renderer,
+                    gestures=gestures)
 
 high_button = Button(title='High',
                      left_led_index=6,
                      right_led_index=7,
                      switch_pin=10,
                      on_button_event=on_button_event,
-                     on_should_render=renderBtn)
+                     renderer=renderer,
+                     gestures=gestures)
 
 reverse_button = Button(title='Reverse',
                         left_led_index=8,
                         right_led_index=9,
                         switch_pin=12,
                         on_button_event=on_button_event,
-                        on_should_render=renderBtn)
+                        renderer=renderer,
+                        gestures=gestures)
 
 trigger_button = Button(title='Trigger',
                         left_led_index=10,
                         right_led_index=11,
                         switch_pin=13,
                         on_button_event=on_button_event,
-                        on_should_render=renderBtn)
+                        renderer=renderer,
+                        gestures=gestures)
 
 # Which control each button is on the wire, and what the mapping engine paints
 # when the host owns it. Keyed on the object, so renaming a button cannot
@@ -360,13 +470,14 @@ _CONTROL_IDS_BY_BUTTON = {}
 for _control_id in _BUTTONS_BY_CONTROL_ID:
     _CONTROL_IDS_BY_BUTTON[_BUTTONS_BY_CONTROL_ID[_control_id]] = _control_id
 
-foot_pedal = IOEventSource(title='Foot Pedal', pin_number=6, pin_mode=Pin.IN, pin_pull=Pin.PULL_DOWN, on_event=on_foot_pedal_event)
+foot_pedal = IOEventSource(title='Foot Pedal', pin_number=6, pin_mode=Pin.IN, pin_pull=Pin.PULL_DOWN, on_event=on_foot_pedal_event, gestures=gestures)
 
-secondary_pedal = IOEventSource(title='Secondary Trigger', pin_number=7, pin_mode=Pin.IN, pin_pull=Pin.PULL_DOWN, on_event=on_aux_pedal_event)
+secondary_pedal = IOEventSource(title='Secondary Trigger', pin_number=7, pin_mode=Pin.IN, pin_pull=Pin.PULL_DOWN, on_event=on_aux_pedal_event, gestures=gestures)
 
 no_valve = Valve(2)
 nc_valve = Valve(3)
 three_way_valve = Valve(4)
+boot_timeline.mark('controls')
 
 pixel_pump = PixelPumpStateMachine(motor=motor,
                        ui_renderer=renderer,
@@ -383,61 +494,127 @@ pixel_pump = PixelPumpStateMachine(motor=motor,
 
 communication_manager = CommunicationManager(pixel_pump)
 
+# The panel's frame rate: the render clock's below, and the most often the
+# mapping engine repaints for table edits.
+RENDER_FPS = 30
+
 # The mapping table needs the settings manager, which PixelPumpStateMachine
-# owns, so both are wired up after it exists. USBManager reads .mapping lazily
-# per command, and answers ERROR UNKNOWN_COMMAND until this point.
-mapping_table = MappingTable(pixel_pump.settings_manager)
+# owns, so both are wired up after it exists. USBManager reads .mapping and
+# .led_stream lazily per command, and answers ERROR UNKNOWN_COMMAND until this point.
+mapping_table = MappingTable(pixel_pump.settings_manager, MappingStore())
 mapping_engine = MappingEngine(mapping_table,
                                pixel_pump,
                                usb_manager.keyboard,
                                _BUTTONS_BY_CONTROL_ID,
-                               usb_manager.is_vendor_host_active)
+                               usb_manager.is_vendor_host_active,
+                               renderer=renderer,
+                               repaint_interval_ms=1000 // RENDER_FPS)
 usb_manager.mapping = mapping_table
+usb_manager.led_stream = mapping_engine
+boot_timeline.mark('mapping_table')
 
 # Escape hatch, before anything else can paint the LEDs: a host can map every
 # button to FORWARD, and this is the only way back.
-check_factory_reset(mapping_table, renderer, (lift_button.pin, drop_button.pin))
-
-# Lets render the buttons at 30 fps (just for the boot sequence)
-uiTimer = Timer()
-uiTimer.init(freq=60, mode=Timer.PERIODIC,
-             callback=lambda t: renderer.flush_frame_buffer())
-
-# Lets run a fancy rainbow boot sequence followed by a few relay clicks because we can
-run_boot_sequence(renderer, [no_valve, nc_valve, three_way_valve])
-
-uiTimer.deinit()
-
-rendered_at = 0
-
-while True:
-    lift_button.tick()
-    drop_button.tick()
-    low_button.tick()
-    high_button.tick()
-    reverse_button.tick()
-    trigger_button.tick()
-
-    foot_pedal.tick()
-    secondary_pedal.tick()
-
-    no_valve.tick()
-    nc_valve.tick()
-    three_way_valve.tick()
-
-    motor.tick()
-
-    pixel_pump.tick(utime.ticks_ms())
-
-    communication_manager.tick()
-
-    usb_manager.tick()
-
-    # After usb_manager.tick(), so a heartbeat timeout drops the buttons back
-    # to their STANDALONE colours in the same iteration it takes effect.
-    mapping_engine.tick()
-
-    # Render the UI at 30 FPS.
-    if utime.ticks_ms() - rendered_at > 33:
-        renderer.flush_frame_buffer()
-        rendered_at = utime.ticks_ms()
+check_factory_reset(mapping_table, renderer, input_snapshot,
+                    lift_button.pin_mask | drop_button.pin_mask)
+boot_timeline.mark('factory_reset_check')
+
+# One render clock from here on, boot sequence included: core 1 when it can be
+# had, otherwise a task in the loop below. It only flushes until the boot
+# sequence hands the LEDs to the buttons.
+render_core = RenderCore(renderer, fps=RENDER_FPS)
+render_on_core_1 = render_core.start()
+
+
+def _on_boot_finished():
+    render_core.begin_animating()
+    boot_timeline.mark('boot_sequence')
+
+
+# Lets run a fancy rainbow boot sequence followed by a few relay clicks because
+# we can -- in the loop, alongside everything else, so a press cuts it short
+# instead of going unheard.
+boot_sequence = BootSequence(renderer, [no_valve, nc_valve, three_way_valve],
+                             frame_interval_ms=1000 // RENDER_FPS,
+                             on_finished=_on_boot_finished)
+
+# Input is sampled at a fixed rate and the panel repainted by the render
+# clock above; the valves, the motor and USB run when they report work, and the loop sleeps in
+# between. Registration order is the order the old busy loop ticked in, and
+# some of it matters: mapping_engine after usb_manager, see below.
+INPUT_INTERVAL_MS = 5
+STATE_INTERVAL_MS = 5
+COMMUNICATION_INTERVAL_MS = 10
+# The doc's "120 Hz tick": the event queue drains four frames per USB pass.
+USB_INTERVAL_MS = 8
+# A host that stops reading gets retried at that same cadence, not every pass.
+usb_manager.retry_interval_ms = USB_INTERVAL_MS
+
+scheduler = Scheduler(max_sleep_ms=INPUT_INTERVAL_MS)
+
+# First the edges captured since the last pass, then one snapshot of every
+# level, so the gesture engine has both before it advances every control.
+scheduler.every('Edges', INPUT_INTERVAL_MS, edge_capture.drain)
+scheduler.every('Inputs', INPUT_INTERVAL_MS, input_snapshot.sample)
+scheduler.every('Controls', INPUT_INTERVAL_MS, gestures.tick)
+
+scheduler.at_deadline('NO Valve', no_valve.next_deadline, no_valve.tick)
+scheduler.at_deadline('NC Valve', nc_valve.next_deadline, nc_valve.tick)
+scheduler.at_deadline('3-Way Valve', three_way_valve.next_deadline, three_way_valve.tick)
+
+scheduler.at_deadline('Motor', motor.next_deadline, motor.tick)
+
+scheduler.every('State', STATE_INTERVAL_MS,
+                lambda: pixel_pump.tick(utime.ticks_ms()))
+
+scheduler.every('CDC', COMMUNICATION_INTERVAL_MS, communication_manager.tick)
+
+scheduler.every('USB', USB_INTERVAL_MS, usb_manager.tick,
+                deadline=usb_manager.next_deadline)
+
+# Registered after usb_manager.tick(), so in a pass where both run a heartbeat
+# timeout drops the buttons back to their STANDALONE colours straight away.
+scheduler.every('Mapping', INPUT_INTERVAL_MS, mapping_engine.tick)
+
+# Last, so its paint of a pass is what the frame after shows.
+scheduler.at_deadline('Boot', boot_sequence.next_deadline, boot_sequence.tick)
+
+# The watchdog resets the pump if the loop stops feeding it -- with the motor
+# possibly running, a reset is the safe way out. Long enough for a settings
+# flash write; anything past STALL_THRESHOLD_MS is recorded for stats:stalls.
+WATCHDOG_TIMEOUT_MS = 3000
+WATCHDOG_FEED_INTERVAL_MS = 250
+STALL_THRESHOLD_MS = 50
+supervisor = Supervisor(scheduler,
+                        scratch=WATCHDOG_SCRATCH,
+                        ctrl=WATCHDOG_CTRL,
+                        reason=WATCHDOG_REASON,
+                        timeout_ms=WATCHDOG_TIMEOUT_MS,
+                        stall_threshold_ms=STALL_THRESHOLD_MS)
+scheduler.every('Watchdog', WATCHDOG_FEED_INTERVAL_MS, supervisor.feed)
+
+if render_on_core_1:
+    render_core.profile_on(scheduler, 'Render (core 1)')
+else:
+    scheduler.at_deadline('Render', render_core.next_deadline, render_core.tick)
+
+# For stats:loop, stats:render, stats:boot and stats:stalls.
+communication_manager.scheduler = scheduler
+communication_manager.render_core = render_core
+communication_manager.boot_timeline = boot_timeline
+communication_manager.supervisor = supervisor
+communication_manager.mapping_store = mapping_table.store
+
+boot_sequence.start()
+# Armed last: check_factory_reset() above may hold boot for seconds.
+supervisor.start()
+boot_timeline.mark('loop_start')
+
+try:
+    scheduler.run_forever()
+finally:
+    # Ctrl-C and reset:soft end the program but not core 1 -- and a core 1
+    # still running the old loop is what makes the next run fall back to
+    # rendering on core 0. Nor the watchdog, which would reset the REPL.
+    render_core.stop()
+    supervisor.stop()
@@ -0,0 +1,117 @@
+"""Where the main loop's time goes, per task, on a unit in the field.
+
+Off by default and then free: the scheduler checks for a profiler once per
+pass, not per task. Switched on over CDC (``stats:loop:on``), it times every
+task the scheduler runs, plus anything registered from outside it -- the
+render core's frames, which core 1 times on a profiler of its own and core 0
+copies in when it reports -- and counts the passes that blew the budget.
+"""
+
+import array
+
+# Histogram bucket b counts durations below _BUCKET_BASE_US << b; the last
+# bucket is open-ended. 16 us .. 262 ms covers a bare pin read up to a flash
+# write, which is the whole range worth telling apart.
+_BUCKET_BASE_US = 16
+_BUCKETS = 15
+
+# Totals are kept below the small-int limit so recording never allocates;
+# past it count and total are halved together, which keeps the average. The
+# render clock's jitter totals follow the same rule.
+TOTAL_LIMIT = 0x3FFFFFFF
+
+
+class LoopProfiler:
+    def __init__(self, names, budget_us):
+        count = len(names)
+        self.names = names
+        self.budget_us = budget_us
+        self.counts = array.array("I", [0] * count)
+        self.totals = array.array("I", [0] * count)
+        self.minimums = array.array("I", [0] * count)
+        self.maximums = array.array("I", [0] * count)
+        self.histogram = array.array("I", [0] * (count * _BUCKETS))
+        self.passes = 0
+        self.over_budget = 0
+        self.worst_pass_us = 0
+
+    def reset(self):
+        for index in range(len(self.names)):
+            self.counts[index] = 0
+            self.totals[index] = 0
+            self.minimums[index] = 0
+            self.maximums[index] = 0
+        for index in range(len(self.histogram)):
+            self.histogram[index] = 0
+        self.passes = 0
+        self.over_budget = 0
+        self.worst_pass_us = 0
+
+    def record(self, index, duration_us):
+        count = self.counts[index]
+        total = self.totals[index]
+        if total > TOTAL_LIMIT - duration_us:
+            count >>= 1
+            total >>= 1
+        self.counts[index] = count + 1
+        self.totals[index] = total + duration_us
+        if count == 0 or duration_us < self.minimums[index]:
+            self.minimums[index] = duration_us
+        if duration_us > self.maximums[index]:
+            self.maximums[index] = duration_us
+
+        bucket = 0
+        limit = _BUCKET_BASE_US
+        while duration_us >= limit and bucket < _BUCKETS - 1:
+            bucket += 1
+            limit <<= 1
+        self.histogram[index * _BUCKETS + bucket] += 1
+
+    def copy_row(self, index, other, other_index):
+        """Overwrite task ``index`` with ``other``'s task ``other_index``."""
+        self.counts[index] = other.counts[other_index]
+        self.totals[index] = other.totals[other_index]
+        self.minimums[index] = other.minimums[other_index]
+        self.maximums[index] = other.maximums[other_index]
+        base = index * _BUCKETS
+        other_base = other_index * _BUCKETS
+        for bucket in range(_BUCKETS):
+            self.histogram[base + bucket] = other.histogram[other_base + bucket]
+
+    def end_pass(self, duration_us):
+        self.passes += 1
+        if duration_us > self.budget_us:
+            self.over_budget += 1
+        if duration_us > self.worst_pass_us:
+            self.worst_pass_us = duration_us
+
+    def percentile(self, index, fraction):
+        """Upper bound of the bucket the ``fraction`` quantile falls in, in us."""
+        base = index * _BUCKETS
+        seen = 0
+        for bucket in range(_BUCKETS):
+            seen += self.histogram[base + bucket]
+        wanted = seen * fraction
+        seen = 0
+        for bucket in range(_BUCKETS):
+            seen += self.histogram[base + bucket]
+            if seen and seen >= wanted:
+                return _BUCKET_BASE_US << bucket
+        return 0
+
+    def lines(self):
+        """The report ``stats:loop`` prints, one line per task."""
+        yield ("passes=" + str(self.passes)
+               + ",over_budget=" + str(self.over_budget)
+               + ",budget_us=" + str(self.budget_us)
+               + ",worst_pass_us=" + str(self.worst_pass_us))
+        yield "task,count,min_us,avg_us,max_us,p99_us"
+        for index in range(len(self.names)):
+            count = self.counts[index]
+            average = self.totals[index] // count if count else 0
+            yield (self.names[index]
+                   + "," + str(count)
+                   + "," + str(self.minimums[index])
+                   + "," + str(average)
+                   + "," + str(self.maximums[index])
+                   + "," + str(self.percentile(index, 0.99)))
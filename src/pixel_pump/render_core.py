@@ -0,0 +1,240 @@
+"""LED animation and rendering on the RP2040's second core.
+
+Every frame the renderer's animation engine advances all twelve LEDs and the
+frame buffer is shifted out to the WS2812 chain -- work that used to run
+inside the input pass on core 0. Here it runs on core 1, started with
+``_thread``, and core 0 only posts targets.
+
+The hand-off is the engine's spinlock-guarded posted record
+(``UIRenderer.post`` writes it, ``UIRenderer.animate`` takes it).
+Deliberately not the SIO inter-core FIFO: MicroPython's flash writes pause
+core 1 through that FIFO (pico-sdk's multicore lockout), and anything else
+reading it would swallow their handshake.
+"""
+
+import _thread
+from machine import mem32
+import utime
+
+from .profiler import TOTAL_LIMIT, LoopProfiler
+
+
+class Spinlock:
+    """One of the RP2040's 32 hardware spinlocks, driven through SIO.
+
+    Reading the lock's register claims it (non-zero) or reports it already
+    held (zero); writing anything releases it. Only ever held around a few
+    stores, so waiting is a spin rather than a sleep.
+    """
+
+    def __init__(self, address):
+        self.address = address
+
+    def acquire(self):
+        while mem32[self.address] == 0:
+            pass
+
+    def release(self):
+        mem32[self.address] = 0
+
+
+# A frame starting more than this after its slot counts as late. Core 1 sleeps
+# in whole milliseconds before its last sub-millisecond wait, so anything
+# under 2 ms is the clock working, not the panel falling behind.
+LATE_TOLERANCE_US = 2000
+
+
+class RenderCore:
+    """The one render clock: animates the LEDs and flushes the frame buffer
+    at ``fps``, from boot onwards.
+
+    Frames keep a fixed cadence -- each slot is a whole interval after the
+    last, not after whenever the last one finished -- so the rate does not
+    drift with load. A frame that starts past its slot is late; slots that
+    passed without a frame at all are dropped, counted and skipped rather
+    than rendered in a burst.
+
+    ``start()`` runs the clock on core 1. If core 1 cannot be had --
+    typically a Ctrl-C during development left the previous run's thread
+    there -- it answers False and the caller schedules ``tick()`` on core 0
+    at ``next_deadline()`` instead; the renderer works the same either way.
+    Until ``begin_animating()`` only the frame buffer is flushed, which is
+    what the boot sequence paints into.
+    """
+
+    def __init__(self, renderer, fps=30):
+        self.renderer = renderer
+        self.animating = False
+        self.running = False
+        self.set_rate(fps)
+        self.next_frame_us = None
+        self._clear_stats()
+        # Set by profile_on(): core 1's frames are timed whenever the main
+        # loop's profiler is switched on -- on frame_profiler, which only core
+        # 1 writes, and copied into the loop profiler's row for them by
+        # fold_profile() on core 0. profiled_for is the loop profiler they
+        # have been timed for since; a new one, or a posted reset, has core 1
+        # zero its own counters.
+        self.scheduler = None
+        self.profile_index = 0
+        self.frame_profiler = None
+        self.profiled_for = None
+        self.profile_reset_requested = False
+
+    def set_rate(self, fps):
+        self.fps = fps
+        self.frame_interval_us = 1000000 // fps
+
+    def reset_stats(self):
+        """Zero the frame statistics -- done by tick() before its next frame,
+        on whichever core runs the clock, so they are never cleared halfway
+        through one being recorded."""
+        self.stats_reset_requested = True
+
+    def _clear_stats(self):
+        self.stats_reset_requested = False
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.first_frame_us = 0
+        self.last_frame_us = 0
+        self.interval_min_us = 0
+        self.interval_max_us = 0
+        self.intervals = 0
+        self.jitter_total_us = 0
+
+    def begin_animating(self):
+        """Hand the LEDs to the animation engine, which repaints them all:
+        what painted them before did not go through it."""
+        self.renderer.repaint()
+        self.animating = True
+
+    def frame(self):
+        if self.animating:
+            self.renderer.animate(utime.ticks_ms())
+        self.renderer.flush_frame_buffer()
+
+    def next_deadline(self):
+        """The ticks_ms of the next frame slot, for the core 0 scheduler."""
+        if self.next_frame_us is None:
+            return utime.ticks_ms()
+        wait_us = utime.ticks_diff(self.next_frame_us, utime.ticks_us())
+        return utime.ticks_add(utime.ticks_ms(), wait_us // 1000)
+
+    def tick(self):
+        """Render a frame if its slot has come. Returns whether it did."""
+        now_us = utime.ticks_us()
+        if self.next_frame_us is None:
+            self.next_frame_us = now_us
+        interval_us = self.frame_interval_us
+        lateness_us = utime.ticks_diff(now_us, self.next_frame_us)
+        if lateness_us < 0:
+            return False
+
+        if self.stats_reset_requested:
+            self._clear_stats()
+        if lateness_us >= interval_us:
+            missed = lateness_us // interval_us
+            self.dropped_frames += missed
+            lateness_us -= missed * interval_us
+            self.next_frame_us = utime.ticks_add(self.next_frame_us,
+                                                 missed * interval_us)
+        if lateness_us > LATE_TOLERANCE_US:
+            self.late_frames += 1
+        self._record_start(now_us)
+
+        self.frame()
+        self.next_frame_us = utime.ticks_add(self.next_frame_us, interval_us)
+        return True
+
+    def _record_start(self, now_us):
+        if self.frames == 0:
+            self.first_frame_us = now_us
+        else:
+            interval_us = utime.ticks_diff(now_us, self.last_frame_us)
+            if self.intervals == 0 or interval_us < self.interval_min_us:
+                self.interval_min_us = interval_us
+            if interval_us > self.interval_max_us:
+                self.interval_max_us = interval_us
+            deviation_us = interval_us - self.frame_interval_us
+            if deviation_us < 0:
+                deviation_us = -deviation_us
+            # Halved with their count past the loop profiler's limit, so they
+            # stay small ints.
+            if self.jitter_total_us > TOTAL_LIMIT - deviation_us:
+                self.intervals >>= 1
+                self.jitter_total_us >>= 1
+            self.intervals += 1
+            self.jitter_total_us += deviation_us
+        self.last_frame_us = now_us
+        self.frames += 1
+
+    def stats_line(self):
+        """What ``stats:render`` prints."""
+        fps = 0.0
+        elapsed_us = utime.ticks_diff(self.last_frame_us, self.first_frame_us)
+        if self.frames > 1 and elapsed_us > 0:
+            fps = (self.frames - 1) * 1000000 / elapsed_us
+        jitter_us = self.jitter_total_us // self.intervals if self.intervals else 0
+        return ("target_fps=" + str(self.fps)
+                + ",fps=" + "{:.2f}".format(fps)
+                + ",frames=" + str(self.frames)
+                + ",late=" + str(self.late_frames)
+                + ",dropped=" + str(self.dropped_frames)
+                + ",interval_min_us=" + str(self.interval_min_us)
+                + ",interval_max_us=" + str(self.interval_max_us)
+                + ",jitter_avg_us=" + str(jitter_us))
+
+    def profile_on(self, scheduler, name):
+        self.profile_index = scheduler.add_external(name)
+        self.frame_profiler = LoopProfiler([name], 0)
+        self.scheduler = scheduler
+
+    def reset_profile(self):
+        """Have core 1 zero its frame timings, before its next frame."""
+        self.profile_reset_requested = True
+
+    def fold_profile(self, profiler):
+        """Copy core 1's frame timings into ``profiler``, on core 0.
+
+        Skipped while core 1 has still to zero them for a reset or a newly
+        enabled profiler, whose row then reads as empty.
+        """
+        if (self.frame_profiler is None or self.profile_reset_requested
+                or self.profiled_for is not profiler):
+            return
+        profiler.copy_row(self.profile_index, self.frame_profiler, 0)
+
+    def start(self):
+        self.running = True
+        try:
+            _thread.start_new_thread(self._run, ())
+        except OSError:
+            self.running = False
+        return self.running
+
+    def stop(self):
+        """Ask the core 1 loop to finish its frame and exit."""
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            profiler = self.scheduler.profiler if self.scheduler is not None else None
+            if profiler is None:
+                self.profiled_for = None
+                self.tick()
+            else:
+                frame_profiler = self.frame_profiler
+                if self.profile_reset_requested or profiler is not self.profiled_for:
+                    frame_profiler.reset()
+                    self.profile_reset_requested = False
+                    self.profiled_for = profiler
+                started_us = utime.ticks_us()
+                if self.tick():
+                    frame_profiler.record(0, utime.ticks_diff(utime.ticks_us(), started_us))
+
+            wait_us = utime.ticks_diff(self.next_frame_us, utime.ticks_us())
+            if wait_us >= 1000:
+                utime.sleep_ms(wait_us // 1000)
+            elif wait_us > 0:
+                utime.sleep_us(wait_us)
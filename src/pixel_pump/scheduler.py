@@ -0,0 +1,160 @@
+"""Deadline-driven cooperative scheduler for the main loop.
+
+The loop used to tick every component flat out, so core 0 sat at 100% doing
+nothing and every feature added to it made the rest jitter more. Here each
+component says when it next needs to run -- a fixed interval, a deadline it
+reports itself, or both -- and the loop sleeps until the earliest of them.
+
+Tasks run in the order they were added, which is the order the old loop
+ticked them in; several of them rely on it (see pixel_pump.py).
+"""
+
+import utime
+
+from .profiler import LoopProfiler
+
+
+def earliest(a, b):
+    """The sooner of two ``ticks_ms`` deadlines; None means "no deadline"."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if utime.ticks_diff(a, b) <= 0:
+        return a
+    return b
+
+
+class Task:
+    def __init__(self, name, callback, interval_ms=None, deadline=None):
+        self.name = name
+        # Position in the scheduler, which is what a stall record keeps.
+        self.index = 0
+        self.callback = callback
+        self.interval_ms = interval_ms
+        # A callable returning the next ticks_ms the component has work at, or
+        # None while it has none. Asked every pass, so it must be cheap.
+        self.deadline = deadline
+        self.next_run_ms = None
+
+    def due_at(self):
+        """The next ticks_ms this task wants to run at, or None."""
+        due = self.next_run_ms
+        if self.deadline is not None:
+            due = earliest(due, self.deadline())
+        return due
+
+    def run(self, now_ms):
+        self.callback()
+        if self.interval_ms is None:
+            return
+        next_run_ms = utime.ticks_add(self.next_run_ms, self.interval_ms)
+        # An overrun pushes the schedule back rather than queueing catch-up
+        # runs -- a late input sample is worth one run, not three.
+        if utime.ticks_diff(next_run_ms, now_ms) <= 0:
+            next_run_ms = utime.ticks_add(now_ms, self.interval_ms)
+        self.next_run_ms = next_run_ms
+
+
+class Scheduler:
+    """Runs due tasks, then sleeps until the next one is due.
+
+    ``max_sleep_ms`` bounds the sleep for anything that can become due without
+    the loop noticing -- a USB report lands in a callback, not in a task.
+    """
+
+    def __init__(self, max_sleep_ms=10):
+        self.max_sleep_ms = max_sleep_ms
+        self.tasks = []
+        # Work run elsewhere that has a row on the scheduler's profiler, i.e.
+        # the render core, which fills it in itself. Listed ahead of the
+        # tasks, so their indexes hold still while tasks are added.
+        self.external = []
+        self.profiler = None
+        # The task running right now and when it started, or None between
+        # tasks -- read from the supervisor's timer IRQ to catch stalls.
+        self.active = None
+        self.active_since_ms = 0
+
+    def every(self, name, interval_ms, callback, deadline=None):
+        """Run ``callback`` every ``interval_ms``, and also at ``deadline()``."""
+        task = Task(name, callback, interval_ms=interval_ms, deadline=deadline)
+        task.next_run_ms = utime.ticks_ms()
+        task.index = len(self.tasks)
+        self.tasks.append(task)
+        return task
+
+    def at_deadline(self, name, deadline, callback):
+        """Run ``callback`` only when ``deadline()`` says the component is due."""
+        task = Task(name, callback, deadline=deadline)
+        task.index = len(self.tasks)
+        self.tasks.append(task)
+        return task
+
+    def add_external(self, name):
+        """Profile ``name`` alongside the tasks; returns its profiler index."""
+        self.external.append(name)
+        return len(self.external) - 1
+
+    def enable_profiler(self, budget_us):
+        names = self.external + [task.name for task in self.tasks]
+        self.profiler = LoopProfiler(names, budget_us)
+
+    def disable_profiler(self):
+        self.profiler = None
+
+    def run_once(self):
+        """One pass: run every due task. Returns the ms until the next is due."""
+        now_ms = utime.ticks_ms()
+        if self.profiler is None:
+            for task in self.tasks:
+                due = task.due_at()
+                if due is not None and utime.ticks_diff(now_ms, due) >= 0:
+                    self.active_since_ms = utime.ticks_ms()
+                    self.active = task
+                    task.run(now_ms)
+                    self.active = None
+        else:
+            self._run_profiled(now_ms, self.profiler)
+
+        # Asked again after the pass, because running one task moves the
+        # deadlines of others -- a pedal press arms a valve, a command queues
+        # a USB response.
+        now_ms = utime.ticks_ms()
+        wait_ms = self.max_sleep_ms
+        for task in self.tasks:
+            due = task.due_at()
+            if due is None:
+                continue
+            remaining = utime.ticks_diff(due, now_ms)
+            if remaining < wait_ms:
+                wait_ms = remaining
+        if wait_ms < 0:
+            wait_ms = 0
+        return wait_ms
+
+    def _run_profiled(self, now_ms, profiler):
+        # The same pass as run_once(), with each task and the pass timed.
+        # Only tasks that ran are recorded: an idle valve is not a fast one.
+        index = len(self.external)
+        pass_started_us = utime.ticks_us()
+        for task in self.tasks:
+            due = task.due_at()
+            if due is not None and utime.ticks_diff(now_ms, due) >= 0:
+                started_us = utime.ticks_us()
+                self.active_since_ms = utime.ticks_ms()
+                self.active = task
+                task.run(now_ms)
+                self.active = None
+                profiler.record(index, utime.ticks_diff(utime.ticks_us(), started_us))
+            index += 1
+        profiler.end_pass(utime.ticks_diff(utime.ticks_us(), pass_started_us))
+
+    def run_forever(self):
+        while True:
+            wait_ms = self.run_once()
+            if wait_ms > 0:
+                # On rp2 sleep_ms waits on WFE and keeps servicing the USB
+                # stack and scheduled callbacks, so sleeping here is what
+                # frees the core without making the pump deaf.
+                utime.sleep_ms(wait_ms)
@@ -15,11 +15,13 @@ DEFAULT_SETTINGS = {
     "secondary_pedal_key_modifier": 0x00,
     "secondary_pedal_long_key": 0x52,
     "secondary_pedal_long_key_modifier": 0x00,
-    # Non-default mapping rows only, as [control, slot, gesture, action, param].
-    # Must be listed here or migrate_settings() would delete it on every boot.
-    "mappings": [],
 }
 
+# Keys that are no longer settings but are kept until their new owner has
+# taken them over: "mappings" held the mapping table's overrides before
+# mapping_store.py, and MappingTable moves them there on its first boot.
+LEGACY_KEYS = ("mappings",)
+
 
 class SettingsManager:
     def __init__(self, file_name="settings.json"):
@@ -34,8 +36,8 @@ class SettingsManager:
                 self.settings = ujson.load(file)
         except OSError:  # open failed. Lets create one
             with open(self.file_name, "w") as file:
-                # A copy, not the module dict itself -- "mappings" is mutable
-                # and aliasing it would let a device write reach the defaults.
+                # A copy, not the module dict itself, so a device write can
+                # never reach the defaults.
                 self.settings = dict(DEFAULT_SETTINGS)
                 ujson.dump(self.settings, file)
 
@@ -48,7 +50,7 @@ class SettingsManager:
         # remove obsolete settings -- over a copy of the keys, since deleting
         # from a dict while iterating it skips entries
         for key in list(self.settings):
-            if key not in DEFAULT_SETTINGS:
+            if key not in DEFAULT_SETTINGS and key not in LEGACY_KEYS:
                 del self.settings[key]
 
         self.persist_settings()
@@ -168,13 +170,12 @@ class SettingsManager:
     def get_secondary_pedal_long_key_modifier(self):
         return self.get_property("secondary_pedal_long_key_modifier", default=0x00)
 
-    def get_mappings(self):
-        return self.get_property("mappings", default=[])
+    def get_legacy_mappings(self):
+        """Mapping rows from before mapping_store.py, or None if there are none."""
+        return self.settings.get("mappings")
 
-    def set_mappings(self, mappings, persist=True):
-        # Unconditional write, unlike set_property: COMMIT_MAPPINGS asks for a
-        # flash write and its ACK is the host's proof that one happened.
-        self.settings["mappings"] = mappings
-        if persist:
+    def drop_legacy_mappings(self):
+        if "mappings" in self.settings:
+            del self.settings["mappings"]
             return self.persist_settings()
         return True
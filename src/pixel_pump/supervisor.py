@@ -0,0 +1,140 @@
+"""Watchdog and stall forensics for the main loop.
+
+A settings flash write, a CDC print the host is not reading, or a key report
+waiting out its timeout can hold the loop -- with the motor running. The
+hardware watchdog, fed by a scheduler task, resets the pump if the loop stops
+for good. A timer IRQ beside it watches which task the scheduler is in and,
+once one has run past the stall threshold, records it: the last few stalls in
+RAM for ``stats:stalls``, and the latest in the watchdog's scratch registers,
+which survive the reset it may end in.
+"""
+
+import array
+from machine import Timer, WDT, mem32
+import utime
+
+# Scratch registers 0-3 are the application's; the boot ROM and pico-sdk use
+# 4-7 for their own reboot handshakes. Kept below 2**30, so writing them from
+# the IRQ never needs a big int.
+_STALL_MAGIC = 0x1A57 << 16
+_MAGIC_MASK = 0x3FFF << 16
+_TASK_MASK = 0xFFFF
+
+_REASON_TIMER_BIT = 0
+
+
+class Supervisor:
+    """Feeds the watchdog and records the scheduler's stalls.
+
+    ``scratch`` is the address of WATCHDOG_SCRATCH0, ``ctrl`` and ``reason``
+    those of WATCHDOG_CTRL and WATCHDOG_REASON, all from pixel_pump.py.
+    """
+
+    def __init__(self, scheduler, scratch, ctrl, reason, timeout_ms=3000,
+                 stall_threshold_ms=50, sample_ms=10, records=8):
+        self.scheduler = scheduler
+        self.scratch = scratch
+        self.ctrl = ctrl
+        self.timeout_ms = timeout_ms
+        self.stall_threshold_ms = stall_threshold_ms
+        self.sample_ms = sample_ms
+        self.wdt = None
+        self.timer = None
+
+        self.tasks = array.array("H", [0] * records)
+        self.durations_ms = array.array("I", [0] * records)
+        self.started_ms = array.array("I", [0] * records)
+        self.count = 0
+        self.next_record = 0
+        # The stall in progress: its run's start time identifies it, since a
+        # task that runs every pass is the active one sample after sample.
+        self.stalling = False
+        self.stall_since_ms = 0
+
+        # What the previous run left behind, read before anything overwrites
+        # it: (task index, duration ms, whether the stall was still going
+        # when the chip reset, whether the watchdog timer reset it). The
+        # timer also reports machine.reset(), which goes through it.
+        self.previous = None
+        first = mem32[scratch]
+        if first & _MAGIC_MASK == _STALL_MAGIC:
+            self.previous = (first & _TASK_MASK,
+                             mem32[scratch + 4],
+                             mem32[scratch + 8] == 1,
+                             (mem32[reason] >> _REASON_TIMER_BIT) & 1 == 1)
+        mem32[scratch] = 0
+
+    def start(self):
+        """Arm the watchdog and the stall sampler; from here feed() or reset."""
+        self.wdt = WDT(timeout=self.timeout_ms)
+        self.timer = Timer(period=self.sample_ms, mode=Timer.PERIODIC,
+                           callback=self._sample, hard=True)
+
+    def feed(self):
+        self.wdt.feed()
+
+    def stop(self):
+        """Disarm both, so a Ctrl-C at the REPL does not end in a reset."""
+        if self.timer is not None:
+            self.timer.deinit()
+        if self.wdt is not None:
+            # MicroPython has no WDT.deinit() on rp2; clearing CTRL.ENABLE
+            # is what pico-sdk's watchdog_disable() does.
+            mem32[self.ctrl] &= ~(1 << 30)
+
+    def _sample(self, timer):
+        # Hard IRQ: ints and preallocated arrays only.
+        scheduler = self.scheduler
+        task = scheduler.active
+        if self.stalling and (task is None
+                              or scheduler.active_since_ms != self.stall_since_ms):
+            # The stalled run has returned; its record is already written.
+            self.stalling = False
+            mem32[self.scratch + 8] = 0
+            self.next_record = (self.next_record + 1) % len(self.tasks)
+            if self.count < len(self.tasks):
+                self.count += 1
+        if task is None:
+            return
+
+        since_ms = scheduler.active_since_ms
+        duration_ms = utime.ticks_diff(utime.ticks_ms(), since_ms)
+        if duration_ms < self.stall_threshold_ms:
+            return
+
+        index = self.next_record
+        self.stalling = True
+        self.stall_since_ms = since_ms
+        self.tasks[index] = task.index
+        self.durations_ms[index] = duration_ms
+        self.started_ms[index] = since_ms
+        mem32[self.scratch + 4] = duration_ms
+        mem32[self.scratch + 8] = 1
+        mem32[self.scratch] = _STALL_MAGIC | task.index
+
+    def reset_records(self):
+        self.count = 0
+        self.next_record = 0
+
+    def task_name(self, index):
+        if index < len(self.scheduler.tasks):
+            return self.scheduler.tasks[index].name
+        return "#" + str(index)
+
+    def lines(self):
+        """The report ``stats:stalls`` prints: last boot's stall, then this one's."""
+        if self.previous is None:
+            yield "previous=none"
+        else:
+            index, duration_ms, ongoing, by_watchdog = self.previous
+            yield ("previous=" + self.task_name(index)
+                   + ",duration_ms=" + str(duration_ms)
+                   + ",ongoing_at_reset=" + ("1" if ongoing else "0")
+                   + ",watchdog_reset=" + ("1" if by_watchdog else "0"))
+        yield "task,duration_ms,started_ms"
+        size = len(self.tasks)
+        for offset in range(self.count):
+            index = (self.next_record - self.count + offset) % size
+            yield (self.task_name(self.tasks[index])
+                   + "," + str(self.durations_ms[index])
+                   + "," + str(self.started_ms[index]))
@@ -1,6 +1,9 @@
 import array
-from machine import Pin
+import math
+from machine import Pin, mem32
 import rp2
+import uctypes
+import utime
 
 
 @rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_LEFT,
@@ -20,18 +23,156 @@ def ws2812():
     wrap()
 
 
+# Easing curves for transitions and waveforms for pulses, by id. Both are
+# 256-step lookup tables of a 0-256 weight, built once at import: a frame
+# looks its weight up rather than computing it.
+EASE_LINEAR = 0
+EASE_OUT = 1
+EASE_IN_OUT = 2
+
+WAVE_SINE = 0
+WAVE_TRIANGLE = 1
+
+
+def _table(shape):
+    return array.array("H", [int(shape(step / 256) * 256 + 0.5) for step in range(257)])
+
+
+_EASINGS = (
+    _table(lambda t: t),
+    _table(lambda t: 1 - (1 - t) * (1 - t)),
+    _table(lambda t: t * t * (3 - 2 * t)),
+)
+
+# One period from the pulse's "from" end to its "to" end and back.
+_WAVES = (
+    _table(lambda t: (1 - math.cos(2 * math.pi * t)) / 2),
+    _table(lambda t: 2 * t if t < 0.5 else 2 - 2 * t),
+)
+
+# The animation engine's posted record per LED: where it is heading and the
+# two ends of its pulse, each as r, g, b, brightness 0-255, then how to get
+# there.
+_POST_TARGET = 0
+_POST_FROM = 4
+_POST_TO = 8
+_POST_DURATION = 12
+_POST_EASING = 13
+_POST_PERIOD = 14
+_POST_WAVE = 15
+_POST_SIZE = 16
+
+# Frame sequence numbers wrap here, so they stay small ints.
+_SEQUENCE_MASK = 0x3FFFFFFF
+
+# Flags per posted LED. SNAP and RESTART are sticky until the render core
+# takes them, so a later post cannot cancel them before they are seen.
+_PENDING = 1
+_PULSING = 2
+_SNAP = 4
+_RESTART = 8
+
+
 class UIRenderer:
-    def __init__(self, on_rendering_finished=None):
+    """The frame buffer, the LED animation engine that paints it, and the
+    WS2812 chain it is shifted out to.
+
+    A flush builds the output buffer and hands it to a DMA channel paced by
+    the state machine's TX DREQ; the CPU does not wait for the chain. The
+    channel's registers come from pixel_pump.py, which claims it:
+    ``dma_read_address`` and ``dma_trigger`` are its READ_ADDR and CTRL_TRIG
+    registers, and ``dma_ctrl`` the CTRL value that starts a transfer.
+
+    The frame buffer is two frames. Writers -- the animation engine, the boot
+    sequence -- paint the back one (``pixel_array``, ``brightness_array``)
+    and publish it with ``commit()``; a flush only reads the committed front
+    one. A flush can therefore run on another core or off a timer from any
+    writer with no lock: a commit that lands while it reads bumps
+    ``frame_sequence``, and the flush drops what it built and sends the newer
+    frame next time.
+    """
+
+    def __init__(self, dma_read_address, dma_trigger, dma_ctrl, dma_busy_mask,
+                 lock=None, transition_ms=250, easing=EASE_OUT,
+                 pulse_period_ms=600, pulse_wave=WAVE_SINE,
+                 on_rendering_finished=None):
         self.on_rendering_finished = on_rendering_finished
         self.led_count = 12
         self.buttonCount = self.led_count / 2
-        self.is_dirty = True
-        self.brightness_modifier = 1.0
 
-        # Basically our frame buffer
-        self.pixel_array = array.array("I", [0 for _ in range(self.led_count)])
-        self.brightness_array = array.array(
-            "f", [0 for _ in range(self.led_count)])
+        # The animation engine: every LED's shown value, the value its
+        # transition began at, its target and its pulse ends, flat, as r, g,
+        # b, brightness 0-255 -- so a frame is one integer pass over all of
+        # them and allocates nothing. Everything is a function of time: a
+        # transition eases from ``begin`` to its goal over its duration, a
+        # pulse follows its waveform over its period, and neither depends on
+        # how often frames come. Core 0 posts with post(); animate() runs on
+        # the render core. ``lock`` guards the posted record between the two.
+        self.transition_ms = transition_ms
+        self.easing = easing
+        self.pulse_period_ms = pulse_period_ms
+        self.pulse_wave = pulse_wave
+        channels = 4 * self.led_count
+        self.current = array.array("i", [0] * channels)
+        self.begin = array.array("i", [0] * channels)
+        self.target = array.array("i", [0] * channels)
+        self.pulse_from = array.array("i", [0] * channels)
+        self.pulse_to = array.array("i", [0] * channels)
+        self.started_ms = array.array("i", [0] * self.led_count)
+        # 0 once the transition is over, so ticks_ms wrapping round cannot
+        # make an old one look current again.
+        self.duration_ms = array.array("i", [0] * self.led_count)
+        self.curve = bytearray(self.led_count)
+        self.pulsing = bytearray(self.led_count)
+        self.pulse_started_ms = array.array("i", [0] * self.led_count)
+        self.period_ms = array.array("i", [1] * self.led_count)
+        self.wave = bytearray(self.led_count)
+        self.lock = lock
+        self.posted = array.array("i", [0] * (_POST_SIZE * self.led_count))
+        self.posted_flags = bytearray(self.led_count)
+        self.any_posted = False
+        # Nothing moving and nothing pulsing: animate() has nothing to do
+        # until the next post or repaint().
+        self.settled = False
+        self.repaint_all = True
+
+        # Pixels a host streams over USB. LEDs in ``stream_mask`` show these,
+        # GRB packed at full brightness, instead of their animation, which
+        # carries on underneath and is what they go back to. Posted like the
+        # rest: post_stream() replaces the whole posted frame, and the render
+        # core takes only the latest -- one it never saw is simply gone.
+        self.stream_mask = 0
+        self.stream_pixels = array.array("I", [0] * self.led_count)
+        self.posted_stream_mask = 0
+        self.posted_stream = array.array("I", [0] * self.led_count)
+        self.stream_posted = False
+
+        # Basically our frame buffer, twice: the committed front frame at
+        # index ``front``, the other the back frame writers paint, which
+        # pixel_array and brightness_array name. Brightness is kept as 0-255;
+        # the float callers pass is quantised once, in set_led_color().
+        # ``is_dirty`` is the back frame holding paint not yet committed.
+        self.frames = (
+            (array.array("I", [0] * self.led_count), bytearray(self.led_count)),
+            (array.array("I", [0] * self.led_count), bytearray(self.led_count)),
+        )
+        self.front = 0
+        self.pixel_array, self.brightness_array = self.frames[1]
+        self.is_dirty = False
+        # Bumped by every commit, and by anything else that changes what a
+        # flush would build; a flush sends a sequence once.
+        self.frame_sequence = 1
+        self.flushed_sequence = 0
+
+        # Per-LED brightness times the global modifier, as a 16.16 factor per
+        # brightness level: a flush scales each channel with one multiply and
+        # a shift, and no float in sight. A new modifier's table is built on
+        # core 0 and posted whole; the flush only swaps it in, so a table never
+        # changes under one.
+        self.scale_lut = array.array("I", [0] * 256)
+        self.posted_lut = None
+        self.modifier_posted = False
+        self.brightness_modifier = 1.0
 
         # Create the StateMachine with the ws2812 program.
         # Its running at 8MHz so it has 10 clock cycles and outputs data with 800kHz just as the WS2812 spec says.
@@ -41,33 +182,337 @@ class UIRenderer:
         # Activate the state machine
         self.state_machine.active(1)
 
-    def flush_frame_buffer(self):
-        if not self.is_dirty:
+        # What the DMA reads, one word per LED. A word goes out as it would
+        # from put(value, 8): shifted up a byte, green first, so little-endian
+        # it is 0, blue, red, green. Kept as bytes so filling it never makes
+        # an int too big to be small.
+        #
+        # Two of them: a flush builds into output_buffer and compares it with
+        # sent_buffer, the frame on the LEDs, and only a frame that differs
+        # swaps places with it and goes out. A panel that is not changing
+        # costs no DMA and no PIO time.
+        self.output_buffer = bytearray(4 * self.led_count)
+        self.output_address = uctypes.addressof(self.output_buffer)
+        self.sent_buffer = bytearray(4 * self.led_count)
+        self.sent_address = uctypes.addressof(self.sent_buffer)
+        self.has_sent = False
+        self.dma_read_address = dma_read_address
+        self.dma_trigger = dma_trigger
+        self.dma_ctrl = dma_ctrl
+        self.dma_busy_mask = dma_busy_mask
+
+    @property
+    def brightness_modifier(self):
+        return self._brightness_modifier
+
+    @brightness_modifier.setter
+    def brightness_modifier(self, modifier):
+        # A fresh table each time, since the render core may be reading the
+        # one it has; the modifier only changes from the settings menu.
+        scale = int(modifier * 65536)
+        lut = array.array("I", [0] * 256)
+        for level in range(256):
+            lut[level] = level * scale // 255
+        lock = self.lock
+        if lock:
+            lock.acquire()
+        self._brightness_modifier = modifier
+        self.posted_lut = lut
+        self.modifier_posted = True
+        if lock:
+            lock.release()
+
+    def _take_modifier(self):
+        lock = self.lock
+        if lock:
+            lock.acquire()
+        self.scale_lut = self.posted_lut
+        self.posted_lut = None
+        self.modifier_posted = False
+        if lock:
+            lock.release()
+        # The same frame, differently scaled: send it again. flushed_sequence
+        # is the flush's own, so this needs no sequence bump to race a commit.
+        self.flushed_sequence = -1
+
+    def post(self, index, color, brightness, pulse_from=None, pulse_from_brightness=0.0,
+             pulse_to=None, pulse_to_brightness=0.0, snap=False, restart=False,
+             duration_ms=None, easing=None, period_ms=None, wave=None):
+        """Core 0 -> render core: LED ``index`` heads for ``color``, or pulses
+        between ``pulse_from`` and ``pulse_to`` when they are given.
+
+        Rewrites the LED's whole record, so the render core only ever takes
+        the latest request, whole. The change eases in over ``duration_ms``
+        along ``easing``, or at once with ``snap``; a pulse takes
+        ``period_ms`` from one end round to it again, along ``wave``, and
+        ``restart`` starts it over from its "from" end. Each defaults to the
+        renderer's own.
+        """
+        # Quantised and defaulted first: core 1 spins on the lock, so it is
+        # held for the stores and nothing else.
+        level = int(brightness * 255 + 0.5)
+        flags = _PENDING
+        if pulse_from is not None:
+            from_level = int(pulse_from_brightness * 255 + 0.5)
+            to_level = int(pulse_to_brightness * 255 + 0.5)
+            flags |= _PULSING
+        if snap:
+            flags |= _SNAP
+        if restart:
+            flags |= _RESTART
+        if duration_ms is None:
+            duration_ms = self.transition_ms
+        if easing is None:
+            easing = self.easing
+        if period_ms is None:
+            period_ms = self.pulse_period_ms
+        if wave is None:
+            wave = self.pulse_wave
+
+        posted = self.posted
+        base = _POST_SIZE * index
+        lock = self.lock
+        if lock:
+            lock.acquire()
+        posted[base + _POST_TARGET] = color[0]
+        posted[base + _POST_TARGET + 1] = color[1]
+        posted[base + _POST_TARGET + 2] = color[2]
+        posted[base + _POST_TARGET + 3] = level
+        if flags & _PULSING:
+            posted[base + _POST_FROM] = pulse_from[0]
+            posted[base + _POST_FROM + 1] = pulse_from[1]
+            posted[base + _POST_FROM + 2] = pulse_from[2]
+            posted[base + _POST_FROM + 3] = from_level
+            posted[base + _POST_TO] = pulse_to[0]
+            posted[base + _POST_TO + 1] = pulse_to[1]
+            posted[base + _POST_TO + 2] = pulse_to[2]
+            posted[base + _POST_TO + 3] = to_level
+        posted[base + _POST_DURATION] = duration_ms
+        posted[base + _POST_EASING] = easing
+        posted[base + _POST_PERIOD] = period_ms
+        posted[base + _POST_WAVE] = wave
+        self.posted_flags[index] = flags | (self.posted_flags[index] & (_SNAP | _RESTART))
+        self.any_posted = True
+        if lock:
+            lock.release()
+
+    def post_stream(self, mask, rgb=None):
+        """Core 0 -> render core: the LEDs in ``mask`` show host pixels.
+
+        ``rgb`` holds three bytes per LED, by index; without it the LEDs
+        still in ``mask`` keep the pixels they were last posted. LEDs leaving
+        the mask go back to their animation.
+        """
+        posted = self.posted_stream
+        lock = self.lock
+        if lock:
+            lock.acquire()
+        if rgb is not None:
+            for index in range(self.led_count):
+                if (mask >> index) & 1:
+                    offset = 3 * index
+                    posted[index] = (rgb[offset + 1] << 16) | (rgb[offset] << 8) | rgb[offset + 2]
+        self.posted_stream_mask = mask
+        self.stream_posted = True
+        if lock:
+            lock.release()
+
+    def repaint(self):
+        """Write every LED's animated value on the next frame, over whatever
+        else -- the boot sequence -- painted the frame buffer meanwhile."""
+        self.repaint_all = True
+        self.settled = False
+
+    def animate(self, now_ms):
+        """One animation frame for all the LEDs at ``now_ms``, on the render core."""
+        if self.any_posted:
+            self._take_posted(now_ms)
+        if self.stream_posted:
+            self._take_stream()
+        if self.settled:
             return
 
-        dimmer_array = array.array("I", [0 for _ in range(self.led_count)])
-        for index, pixelValue in enumerate(self.pixel_array):
-            brightness = self.brightness_array[index]
-            # 8-bit red dimmed to brightness
-            r = int(((pixelValue >> 8) & 0xFF) *
-                    brightness * self.brightness_modifier)
-            # 8-bit green dimmed to brightness
-            g = int(((pixelValue >> 16) & 0xFF) *
-                    brightness * self.brightness_modifier)
-            # 8-bit blue dimmed to brightness
-            b = int((pixelValue & 0xFF) * brightness *
-                    self.brightness_modifier)
-            # 24-bit color dimmed to brightness
-            dimmer_array[index] = (g << 16) + (r << 8) + b
-
-        # update the state machine with new colors
-        self.state_machine.put(dimmer_array, 8)
+        current = self.current
+        begin = self.begin
+        target = self.target
+        repaint = self.repaint_all
+        self.repaint_all = False
+        streamed = self.stream_mask
+        active = False
+        for index in range(self.led_count):
+            base = 4 * index
+
+            # Where the LED should be with no transition running: its target,
+            # or the point its pulse has reached.
+            pulsing = self.pulsing[index]
+            if pulsing:
+                active = True
+                period = self.period_ms[index]
+                phase = utime.ticks_diff(now_ms, self.pulse_started_ms[index]) % period
+                weight = _WAVES[self.wave[index]][phase * 256 // period]
+                pulse_from = self.pulse_from
+                pulse_to = self.pulse_to
+
+            # ...and how far the transition towards it has got.
+            easing = 256
+            duration = self.duration_ms[index]
+            if duration:
+                elapsed = utime.ticks_diff(now_ms, self.started_ms[index])
+                if elapsed < duration:
+                    easing = _EASINGS[self.curve[index]][elapsed * 256 // duration]
+                    active = True
+                else:
+                    self.duration_ms[index] = 0
+
+            changed = repaint
+            for offset in range(base, base + 4):
+                if pulsing:
+                    goal = pulse_from[offset] + (((pulse_to[offset] - pulse_from[offset]) * weight) >> 8)
+                else:
+                    goal = target[offset]
+                if easing < 256:
+                    goal = begin[offset] + (((goal - begin[offset]) * easing) >> 8)
+                if goal != current[offset]:
+                    current[offset] = goal
+                    changed = True
+            if changed and not (streamed >> index) & 1:
+                self.pixel_array[index] = ((current[base + 1] << 16)
+                                           | (current[base] << 8)
+                                           | current[base + 2])
+                self.brightness_array[index] = current[base + 3]
+                self.is_dirty = True
+        self.settled = not active
+        self.commit()
+
+    def _take_stream(self):
+        lock = self.lock
+        if lock:
+            lock.acquire()
+        mask = self.posted_stream_mask
+        for index in range(self.led_count):
+            if (mask >> index) & 1:
+                self.stream_pixels[index] = self.posted_stream[index]
+        self.stream_posted = False
+        if lock:
+            lock.release()
+
+        for index in range(self.led_count):
+            if (mask >> index) & 1:
+                self.pixel_array[index] = self.stream_pixels[index]
+                self.brightness_array[index] = 255
+        if self.stream_mask & ~mask:
+            # Released LEDs show their animation again.
+            self.repaint_all = True
+            self.settled = False
+        self.stream_mask = mask
+        self.is_dirty = True
+        self.commit()
+
+    def _take_posted(self, now_ms):
+        posted = self.posted
+        current = self.current
+        lock = self.lock
+        if lock:
+            lock.acquire()
+        self.any_posted = False
+        for index in range(self.led_count):
+            flags = self.posted_flags[index]
+            if not flags & _PENDING:
+                continue
+            self.posted_flags[index] = 0
+            base = 4 * index
+            post_base = _POST_SIZE * index
+            for channel in range(4):
+                # The transition starts from what is shown, mid-way through
+                # another one or a pulse included.
+                self.begin[base + channel] = current[base + channel]
+                self.target[base + channel] = posted[post_base + _POST_TARGET + channel]
+                self.pulse_from[base + channel] = posted[post_base + _POST_FROM + channel]
+                self.pulse_to[base + channel] = posted[post_base + _POST_TO + channel]
+            self.started_ms[index] = now_ms
+            self.duration_ms[index] = 0 if flags & _SNAP else posted[post_base + _POST_DURATION]
+            self.curve[index] = posted[post_base + _POST_EASING]
+            self.period_ms[index] = posted[post_base + _POST_PERIOD] or 1
+            self.wave[index] = posted[post_base + _POST_WAVE]
+            self.pulsing[index] = 1 if flags & _PULSING else 0
+            if flags & _RESTART:
+                self.pulse_started_ms[index] = now_ms
+        if lock:
+            lock.release()
+        self.settled = False
+
+    def commit(self):
+        """Publish the back frame: it becomes the front one a flush reads, and
+        the new back frame starts as a copy of it."""
+        if not self.is_dirty:
+            return
+        back = self.front ^ 1
+        # The swap is the one store; from it on a flush reads the new frame.
+        # The sequence moves before the old front is touched, so a flush that
+        # was still reading it knows to drop what it built.
+        self.front = back
+        self.frame_sequence = (self.frame_sequence + 1) & _SEQUENCE_MASK
+        pixels, levels = self.frames[back]
+        old_pixels, old_levels = self.frames[back ^ 1]
+        for index in range(self.led_count):
+            old_pixels[index] = pixels[index]
+            old_levels[index] = levels[index]
+        self.pixel_array = old_pixels
+        self.brightness_array = old_levels
         self.is_dirty = False
 
+    def is_transfer_busy(self):
+        return mem32[self.dma_trigger] & self.dma_busy_mask != 0
+
+    def flush_frame_buffer(self):
+        if self.modifier_posted:
+            self._take_modifier()
+        sequence = self.frame_sequence
+        if sequence == self.flushed_sequence:
+            return
+        # The previous frame is still going out of the buffer this one would
+        # be built in. Stay dirty; the next flush sends the newer frame.
+        if self.is_transfer_busy():
+            return
+
+        output = self.output_buffer
+        pixels, levels = self.frames[self.front]
+        lut = self.scale_lut
+        for index in range(self.led_count):
+            pixel = pixels[index]
+            scale = lut[levels[index]]
+            offset = 4 * index
+            output[offset + 1] = ((pixel & 0xFF) * scale) >> 16
+            output[offset + 2] = (((pixel >> 8) & 0xFF) * scale) >> 16
+            output[offset + 3] = (((pixel >> 16) & 0xFF) * scale) >> 16
+
+        if self.frame_sequence != sequence:
+            # Committed over while being read: possibly torn, and stale anyway.
+            return
+        self.flushed_sequence = sequence
+        if self.has_sent and output == self.sent_buffer:
+            return
+
+        self.output_buffer, self.sent_buffer = self.sent_buffer, output
+        self.output_address, self.sent_address = self.sent_address, self.output_address
+        self.has_sent = True
+        # READ_ADDR has walked to the end of the buffer; the transfer count
+        # reloads by itself when CTRL_TRIG is written.
+        mem32[self.dma_read_address] = self.sent_address
+        mem32[self.dma_trigger] = self.dma_ctrl
+
         if self.on_rendering_finished:
             self.on_rendering_finished()
 
     def set_led_color(self, index, color, brightness=1.0):
+        pixel = (color[1] << 16) + (color[0] << 8) + color[2]
+        level = int(brightness * 255 + 0.5)
+        if level < 0:
+            level = 0
+        elif level > 255:
+            level = 255
+        if self.pixel_array[index] == pixel and self.brightness_array[index] == level:
+            return
+        self.pixel_array[index] = pixel
+        self.brightness_array[index] = level
         self.is_dirty = True
-        self.pixel_array[index] = (color[1] << 16) + (color[0] << 8) + color[2]
-        self.brightness_array[index] = brightness
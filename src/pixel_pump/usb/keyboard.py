@@ -45,6 +45,10 @@ class Keyboard:
             self._clear_at_ms = None
             self._send_keys([])
 
+    def next_deadline(self):
+        # When tick() has a tap to release, for the main-loop scheduler.
+        return self._clear_at_ms
+
     def press(self, modifier, keycode):
         if not self.enabled:
             return False
@@ -21,6 +21,8 @@ from .protocol import (
     info_ack_payload,
 )
 from .vendor_hid import VendorHIDInterface
+from ..mapping_store import ROW_SIZE
+from ..scheduler import earliest
 
 try:
     from ..version import dev as FW_DEV_BUILD
@@ -35,6 +37,46 @@ except ImportError:
 MODEL_ID = ModelId.PIXEL_PUMP_1
 
 
+class PP1CommandId:
+    """Commands only this model answers, numbered clear of ``CommandId``.
+
+    Kept here for the same reason as MODEL_ID; a Pixel Pump 2 answers them
+    ``ERROR UNKNOWN_COMMAND``, as it does any id it does not know.
+    """
+
+    # Byte 4 is (frame << 4) | led, bytes 5..7 that LED's red, green, blue.
+    # led 0x0F presents the frame: no ACK for pixels, one for the frame.
+    STREAM_LEDS = 0x40
+    # A SET_MAPPING transaction: the SET_MAPPINGs between these two are
+    # checked as they arrive but held back, then applied together by
+    # END_MAPPINGS. Byte 4 of END_MAPPINGS may carry MAPPINGS_COMMIT.
+    BEGIN_MAPPINGS = 0x41
+    END_MAPPINGS = 0x42
+
+
+STREAM_PRESENT = 0x0F
+# END_MAPPINGS also persists the table, as COMMIT_MAPPINGS would.
+MAPPINGS_COMMIT = 0x01
+
+
+class PP1EventFlags:
+    """Byte 7 of this model's EVENT frames, clear of the shared ``Flags``."""
+
+    # ``value`` is when the event happened: the device's ticks_us at the
+    # edge, in 128 us counts, low 16 bits, as the int16 value field carries
+    # them. Wraps every 8.4 s, far longer than an event waits to be sent, so
+    # a host unwraps it against its own receive time; differences between
+    # stamps are press timing, and arrival minus stamp (less its smallest
+    # value, the clock offset) is the latency this device and USB added.
+    TIMESTAMP = 0x10
+
+
+def event_timestamp(at_us):
+    stamp = (at_us >> 7) & 0xFFFF
+    if stamp & 0x8000:
+        stamp -= 0x10000
+    return stamp
+
 class USBConnectionState:
     NO_DATA = "no_data"
     KEYBOARD_ONLY = "keyboard_only"
@@ -58,15 +100,41 @@ class USBManager:
         is_valid_action(control, gesture, action, param) -> bool
         get(control, gesture, slot) -> (action, param)
         set(control, gesture, slot, action, param) -> None
-        entries() -> iterable of (control, slot, gesture, action, param),
-                     excluding NONE actions
+        set_rows(rows, count) -> None  (``count`` 5-byte rows, control,
+                     slot, gesture, action, param, applied as one change)
+        next_entry(position) -> (next position, control, slot, gesture,
+                     action, param) for the first non-NONE entry at or
+                     after ``position`` (0 is the start), or None past the end
         reset() -> bool   (restore defaults and persist)
         commit() -> bool  (persist the in-RAM table)
 
-    With no mapping table wired up the four commands answer
+    BEGIN_MAPPINGS and END_MAPPINGS (PP1CommandId) batch SET_MAPPINGs. A
+    SET_MAPPING inside a batch is validated as usual, and answered only if it
+    is rejected; the rest are held back until END_MAPPINGS applies them with
+    one ``set_rows()``, commits them if asked, and ACKs with
+    ``(count & 0xFF, count >> 8, committed)``. A batch that had a SET_MAPPING
+    rejected applies nothing: END_MAPPINGS answers with the first rejection's
+    error code instead. BEGIN_MAPPINGS inside a batch starts it over, and an
+    END_MAPPINGS with no batch open is an empty one. A batch still open when
+    the host goes inactive or closes the interface is dropped.
+
+    With no mapping table wired up the mapping commands answer
     ``ERROR UNKNOWN_COMMAND``, which is exactly how the spec's compatibility
     matrix describes a device without mapping support. Phase 4 supplies the
     table; nothing here changes when it does.
+
+    STREAM_LEDS (PP1CommandId) does the same with the optional ``led_stream``
+    object, which must provide:
+
+        stream_leds(rgb, written) -> int  (bit mask of the LEDs shown)
+
+    A host sends a frame as one STREAM_LEDS per LED, all carrying the same
+    4-bit frame counter, then a present. Pixels are staged here and handed on
+    only when their frame is presented, so a frame shows whole or not at all;
+    a pixel carrying a new counter abandons the frame staged before it, and
+    the renderer shows whichever presented frame is latest when it draws.
+    The present's ACK echoes the counter and the mask of LEDs shown, which
+    are the LEDs of the buttons the host owns.
     """
 
     def __init__(
@@ -74,30 +142,38 @@ class USBManager:
         usb_interface_active=True,
         keyboard_enabled=True,
         mapping=None,
-        hold_repeat_ms=120,
         max_queue_size=32,
-        # A bulk GET_MAPPING dump of a fully populated PP1 table is 8 controls
-        # x 2 slots x 4 gestures = 64 frames plus the terminator, and dropping
-        # the terminator leaves the host waiting forever.
-        max_response_queue_size=96,
+        # A bulk GET_MAPPING dump takes one entry however big the table is:
+        # its rows are read off a cursor as report slots free up.
+        max_response_queue_size=32,
+        # SET_MAPPINGs one transaction can hold back: a whole slot column,
+        # with room to spare.
+        max_batch_size=128,
         vendor_host_activity_timeout_ms=1200,
         vendor_host_open_grace_ms=0,
         device_heartbeat_interval_ms=500,
+        # How soon to try again after a pass that could send none of the
+        # frames it had -- the host is not reading the endpoint.
+        retry_interval_ms=8,
         bootloader_flush_delay_ms=150,
         on_usb_data_connection_changed=None,
         on_usb_connection_state_changed=None,
+        on_command_received=None,
         debug=False,
     ):
         self.debug = debug
         self.mapping = mapping
-        self.hold_repeat_ms = hold_repeat_ms
+        self.led_stream = None
         self.max_queue_size = max_queue_size
         self.max_response_queue_size = max_response_queue_size
+        self.max_batch_size = max_batch_size
         self.device_heartbeat_interval_ms = max(1, int(device_heartbeat_interval_ms))
+        self.retry_interval_ms = max(1, int(retry_interval_ms))
         # Spec requires >= 100ms between the ENTER_BOOTLOADER ACK and the reboot
         self.bootloader_flush_delay_ms = max(100, int(bootloader_flush_delay_ms))
         self.on_usb_data_connection_changed = on_usb_data_connection_changed
         self.on_usb_connection_state_changed = on_usb_connection_state_changed
+        self.on_command_received = on_command_received
 
         self.keyboard = Keyboard(enabled=keyboard_enabled)
         self.vendor = VendorHIDInterface(
@@ -129,16 +205,35 @@ class USBManager:
         self._connection_state = USBConnectionState.NO_DATA
         self._event_queue = []
         self._response_queue = []
-        self._last_hold_sent_ms = {}
         self._last_device_heartbeat_sent_ms = None
         self._bootloader_at_ms = None
-
-    def publish_event(self, control_id, event_kind, value=0, flags=0):
+        # Set by a pass that left frames unsent and sent none: next_deadline()
+        # waits for it instead of answering "now" while the host is stuck.
+        self._retry_at_ms = None
+        # Where the bulk GET_MAPPING dump at the head of the response queue
+        # has got to.
+        self._dump_position = 0
+        # The LED frame being staged: its counter, three bytes per LED index
+        # a STREAM_LEDS frame can name, and which of them it has written.
+        self._stream_frame = None
+        self._stream_rgb = bytearray(3 * STREAM_PRESENT)
+        self._stream_written = 0
+        # The open SET_MAPPING transaction: how many rows it holds back (None
+        # with none open), the rows, and the first error one of its
+        # SET_MAPPINGs got.
+        self._batch_count = None
+        self._batch_rows = bytearray(ROW_SIZE * max_batch_size)
+        self._batch_error = 0
+
+    def publish_event(self, control_id, event_kind, value=0, flags=0, at_us=None):
         # Publish-all rule: while the vendor host is active every control is
-        # published, whatever the mapping table says it does locally.
-        if event_kind == EventKind.HOLD and not self._should_emit_hold(control_id):
-            return
-
+        # published, whatever the mapping table says it does locally. HOLD
+        # arrives already at the spec's repeat rate, from the GestureEngine.
+        # ``at_us`` stamps an event whose value is otherwise unused; DELTA's
+        # carries the detents, and merging would blur a stamp anyway.
+        if at_us is not None and event_kind != EventKind.DELTA:
+            value = event_timestamp(at_us)
+            flags |= PP1EventFlags.TIMESTAMP
         if self.vendor.is_host_active():
             self._enqueue_event(control_id, event_kind, value, flags)
         elif self._event_queue:
@@ -164,32 +259,74 @@ class USBManager:
             if not vendor_open:
                 self._last_device_heartbeat_sent_ms = None
                 self._response_queue.clear()
+                self._dump_position = 0
+                self._batch_count = None
 
         if vendor_active != self._was_vendor_active:
             self._was_vendor_active = vendor_active
             if self.debug:
                 print("USB Vendor Host Active:", vendor_active)
-            if not vendor_active and self._event_queue:
+            if not vendor_active:
                 self._event_queue.clear()
+                # A host that timed out mid-batch is not coming back for it;
+                # without this every later SET_MAPPING would be held, unanswered.
+                self._batch_count = None
 
-        self._send_device_heartbeat_if_due(vendor_open)
+        sent = self._send_device_heartbeat_if_due(vendor_open)
 
         if vendor_open:
-            self._flush_response_queue()
+            sent += self._flush_response_queue()
 
-        if not vendor_active:
-            return
+        if vendor_active:
+            events = 0
+            while self._event_queue and events < 4:
+                control_id, event_kind, value, flags = self._event_queue[0]
+                if self.vendor.send_event(
+                    control_id, event_kind, value=value, flags=flags, timeout_ms=0
+                ):
+                    self._event_queue.pop(0)
+                    events += 1
+                else:
+                    break
+            sent += events
+
+        if sent or not self._has_frames_due():
+            self._retry_at_ms = None
+        else:
+            self._retry_at_ms = utime.ticks_add(utime.ticks_ms(), self.retry_interval_ms)
+
+    def next_deadline(self):
+        """The next ticks_ms tick() has work at, or None if it has none.
+
+        Queued frames are due at once, unless the last pass could send none
+        of them: then they wait ``retry_interval_ms``, so a host that stops
+        reading cannot keep the loop from sleeping. Everything else here is a
+        timer: the bootloader reboot, the keyboard's tap release and the
+        device heartbeat. Open/close edges and host-activity timeouts are not
+        predictable from here, so the scheduler also runs tick() at a fixed
+        interval to catch them.
+        """
+        if self._has_frames_due():
+            if self._retry_at_ms is not None:
+                return self._retry_at_ms
+            return utime.ticks_ms()
+
+        deadline = earliest(self._bootloader_at_ms, self.keyboard.next_deadline())
+        if self.vendor.is_host_open():
+            deadline = earliest(
+                deadline,
+                utime.ticks_add(
+                    self._last_device_heartbeat_sent_ms,
+                    self.device_heartbeat_interval_ms,
+                ),
+            )
+        return deadline
 
-        sent = 0
-        while self._event_queue and sent < 4:
-            control_id, event_kind, value, flags = self._event_queue[0]
-            if self.vendor.send_event(
-                control_id, event_kind, value=value, flags=flags, timeout_ms=0
-            ):
-                self._event_queue.pop(0)
-                sent += 1
-            else:
-                break
+    def _has_frames_due(self):
+        if self._response_queue or (self._event_queue and self.vendor.is_host_active()):
+            return True
+        # The first heartbeat after an open is due at once.
+        return self.vendor.is_host_open() and self._last_device_heartbeat_sent_ms is None
 
     def is_vendor_host_open(self):
         return self.vendor.is_host_open()
@@ -212,17 +349,6 @@ class USBManager:
             keyboard_open, vendor_open, vendor_active, notify=notify
         )
 
-    def _should_emit_hold(self, control_id):
-        now_ms = utime.ticks_ms()
-        last_ms = self._last_hold_sent_ms.get(control_id, None)
-        if (
-            last_ms is not None
-            and utime.ticks_diff(now_ms, last_ms) < self.hold_repeat_ms
-        ):
-            return False
-        self._last_hold_sent_ms[control_id] = now_ms
-        return True
-
     def _enqueue_event(self, control_id, event_kind, value, flags):
         if (
             event_kind == EventKind.DELTA
@@ -265,6 +391,8 @@ class USBManager:
                 print("USB Vendor Raw:", frame)
 
         if len(frame) == REPORT_SIZE and frame[1] == MessageType.COMMAND:
+            if self.on_command_received is not None:
+                self.on_command_received(self, frame[3])
             self._handle_command(frame)
 
     def _handle_command(self, frame):
@@ -296,6 +424,12 @@ class USBManager:
             self._handle_reset_mappings(frame)
         elif command_id == CommandId.COMMIT_MAPPINGS:
             self._handle_commit_mappings()
+        elif command_id == PP1CommandId.STREAM_LEDS:
+            self._handle_stream_leds(frame)
+        elif command_id == PP1CommandId.BEGIN_MAPPINGS:
+            self._handle_begin_mappings()
+        elif command_id == PP1CommandId.END_MAPPINGS:
+            self._handle_end_mappings(frame)
         else:
             self._enqueue_error(command_id, ErrorCode.UNKNOWN_COMMAND)
 
@@ -307,9 +441,9 @@ class USBManager:
         slot, gesture = decode_slot_gesture(frame[5])
 
         if control_id == MAPPING_ALL:
-            for entry in self.mapping.entries():
-                self._enqueue_mapping(entry[0], entry[1], entry[2], entry[3], entry[4])
-            self._enqueue_mapping_end()
+            # The rows, and the terminator after them, are sent by
+            # _flush_response_queue() when it reaches this entry.
+            self._enqueue_response(("dump",))
             return
 
         if not self._check_target(CommandId.GET_MAPPING, control_id, slot, gesture):
@@ -327,11 +461,31 @@ class USBManager:
         action = frame[6]
         param = frame[7]
 
-        if not self._check_target(CommandId.SET_MAPPING, control_id, slot, gesture):
+        error = self._target_error(control_id, slot, gesture)
+        if not error and not self.mapping.is_valid_action(control_id, gesture, action, param):
+            error = ErrorCode.BAD_ACTION
+        batch_count = self._batch_count
+        if not error and batch_count is not None and batch_count >= self.max_batch_size:
+            # The error enum is frozen too: a batch with no room left for
+            # this row cannot hold the table, which STORAGE_ERROR says.
+            error = ErrorCode.STORAGE_ERROR
+        if error:
+            self._enqueue_error(CommandId.SET_MAPPING, error)
+            if batch_count is not None and not self._batch_error:
+                self._batch_error = error
             return
 
-        if not self.mapping.is_valid_action(control_id, gesture, action, param):
-            self._enqueue_error(CommandId.SET_MAPPING, ErrorCode.BAD_ACTION)
+        if batch_count is not None:
+            # Held back for END_MAPPINGS, and not ACKed: that is the point.
+            # Laid out as mapping_store's rows, which set_rows() reads.
+            offset = ROW_SIZE * batch_count
+            rows = self._batch_rows
+            rows[offset] = control_id
+            rows[offset + 1] = slot
+            rows[offset + 2] = gesture
+            rows[offset + 3] = action
+            rows[offset + 4] = param
+            self._batch_count = batch_count + 1
             return
 
         # RAM only -- COMMIT_MAPPINGS persists.
@@ -361,6 +515,64 @@ class USBManager:
         else:
             self._enqueue_error(CommandId.COMMIT_MAPPINGS, ErrorCode.STORAGE_ERROR)
 
+    def _handle_begin_mappings(self):
+        if not self._require_mapping(PP1CommandId.BEGIN_MAPPINGS):
+            return
+
+        self._batch_count = 0
+        self._batch_error = 0
+        self._enqueue_ack(PP1CommandId.BEGIN_MAPPINGS)
+
+    def _handle_end_mappings(self, frame):
+        if not self._require_mapping(PP1CommandId.END_MAPPINGS):
+            return
+
+        count = self._batch_count or 0
+        error = self._batch_error
+        self._batch_count = None
+        self._batch_error = 0
+        if error:
+            self._enqueue_error(PP1CommandId.END_MAPPINGS, error)
+            return
+
+        if count:
+            self.mapping.set_rows(self._batch_rows, count)
+        committed = 0
+        if frame[4] & MAPPINGS_COMMIT:
+            if not self.mapping.commit():
+                self._enqueue_error(PP1CommandId.END_MAPPINGS, ErrorCode.STORAGE_ERROR)
+                return
+            committed = 1
+        self._enqueue_ack(
+            PP1CommandId.END_MAPPINGS, payload=(count & 0xFF, count >> 8, committed)
+        )
+
+    def _handle_stream_leds(self, frame):
+        if self.led_stream is None:
+            self._enqueue_error(PP1CommandId.STREAM_LEDS, ErrorCode.UNKNOWN_COMMAND)
+            return
+
+        counter = frame[4] >> 4
+        led = frame[4] & 0x0F
+        if counter != self._stream_frame:
+            self._stream_frame = counter
+            self._stream_written = 0
+
+        if led != STREAM_PRESENT:
+            offset = 3 * led
+            self._stream_rgb[offset] = frame[5]
+            self._stream_rgb[offset + 1] = frame[6]
+            self._stream_rgb[offset + 2] = frame[7]
+            self._stream_written |= 1 << led
+            return
+
+        shown = self.led_stream.stream_leds(self._stream_rgb, self._stream_written)
+        self._stream_frame = None
+        self._stream_written = 0
+        self._enqueue_ack(
+            PP1CommandId.STREAM_LEDS, payload=(counter, shown & 0xFF, shown >> 8)
+        )
+
     def _require_mapping(self, command_id):
         if self.mapping is None:
             self._enqueue_error(command_id, ErrorCode.UNKNOWN_COMMAND)
@@ -368,21 +580,25 @@ class USBManager:
         return True
 
     def _check_target(self, command_id, control_id, slot, gesture):
-        if not self.mapping.has_control(control_id):
-            self._enqueue_error(command_id, ErrorCode.BAD_CONTROL)
+        error = self._target_error(control_id, slot, gesture)
+        if error:
+            self._enqueue_error(command_id, error)
             return False
+        return True
+
+    def _target_error(self, control_id, slot, gesture):
+        if not self.mapping.has_control(control_id):
+            return ErrorCode.BAD_CONTROL
 
         # Slot rides in the gesture byte and the error enum is frozen with no
         # BAD_SLOT, so an out-of-range slot reports as BAD_GESTURE.
         if slot > MappingSlot.CONNECTED:
-            self._enqueue_error(command_id, ErrorCode.BAD_GESTURE)
-            return False
+            return ErrorCode.BAD_GESTURE
 
         if not self.mapping.has_gesture(control_id, gesture):
-            self._enqueue_error(command_id, ErrorCode.BAD_GESTURE)
-            return False
+            return ErrorCode.BAD_GESTURE
 
-        return True
+        return 0
 
     def _version_flags(self):
         flags = Flags.HAS_VERSION
@@ -407,10 +623,9 @@ class USBManager:
     def _enqueue_mapping(self, control_id, slot, gesture, action, param):
         self._enqueue_response(("mapping", control_id, slot, gesture, action, param))
 
-    def _enqueue_mapping_end(self):
-        self._enqueue_response(("mapping_end",))
-
     def _flush_response_queue(self):
+        """Send what the host can take; returns how many frames went out."""
+        count = 0
         while self._response_queue:
             entry = self._response_queue[0]
             kind = entry[0]
@@ -426,18 +641,33 @@ class USBManager:
                     entry[1], entry[2], entry[3], entry[4], entry[5], timeout_ms=0
                 )
             else:
+                row = self.mapping.next_entry(self._dump_position)
+                if row is not None:
+                    if not self.vendor.send_mapping(
+                        row[1], row[2], row[3], row[4], row[5], timeout_ms=0
+                    ):
+                        return count
+                    # Not popped: the dump goes on from the next row.
+                    self._dump_position = row[0]
+                    count += 1
+                    continue
                 sent = self.vendor.send_mapping_end(timeout_ms=0)
+                if sent:
+                    self._dump_position = 0
 
             if not sent:
-                return
+                return count
 
             self._response_queue.pop(0)
+            count += 1
 
             if kind == "ack" and entry[4]:
                 self._bootloader_at_ms = utime.ticks_add(
                     utime.ticks_ms(), self.bootloader_flush_delay_ms
                 )
 
+        return count
+
     def _resolve_connection_state(self, keyboard_open, vendor_active):
         # With keyboard_enabled False there is no keyboard interface to open,
         # so keyboard_open is always False and KEYBOARD_ONLY never resolves --
@@ -471,15 +701,17 @@ class USBManager:
 
     def _send_device_heartbeat_if_due(self, vendor_open):
         if not vendor_open:
-            return
+            return 0
 
         now_ms = utime.ticks_ms()
         if self._last_device_heartbeat_sent_ms is not None:
             elapsed_ms = utime.ticks_diff(now_ms, self._last_device_heartbeat_sent_ms)
             if elapsed_ms < self.device_heartbeat_interval_ms:
-                return
+                return 0
 
         if self.vendor.send_heartbeat(
             FW_VERSION, dev=FW_DEV_BUILD, model_id=MODEL_ID, timeout_ms=0
         ):
             self._last_device_heartbeat_sent_ms = now_ms
+            return 1
+        return 0
@@ -1,6 +1,8 @@
 from machine import Pin
 import utime
 
+from .scheduler import earliest
+
 
 class Valve:
     def __init__(self, output_pin):
@@ -11,7 +13,7 @@ class Valve:
 
     def activate(self, delay_in_ms=0.0):
         if delay_in_ms > 0:
-            self.activate_at = utime.ticks_ms() + delay_in_ms
+            self.activate_at = utime.ticks_add(utime.ticks_ms(), int(delay_in_ms))
         else:
           self.deactivate_at = None
           self.activate_at = None
@@ -19,15 +21,21 @@ class Valve:
 
     def deactivate(self, delay_in_ms=0.0):
         if delay_in_ms > 0:
-            self.deactivate_at = utime.ticks_ms() + delay_in_ms
+            self.deactivate_at = utime.ticks_add(utime.ticks_ms(), int(delay_in_ms))
         else:
             self.deactivate_at = None
             self.activate_at = None
             self.output_pin.value(0)
 
+    def next_deadline(self):
+        # ticks_add/ticks_diff rather than plain arithmetic: ticks_ms wraps,
+        # and a deadline armed just before the wrap must still come due.
+        return earliest(self.activate_at, self.deactivate_at)
+
     def tick(self):
-        if self.deactivate_at and utime.ticks_ms() >= self.deactivate_at:
+        now_ms = utime.ticks_ms()
+        if self.deactivate_at is not None and utime.ticks_diff(now_ms, self.deactivate_at) >= 0:
             self.deactivate()
 
-        if self.activate_at and utime.ticks_ms() >= self.activate_at:
+        if self.activate_at is not None and utime.ticks_diff(now_ms, self.activate_at) >= 0:
             self.activate()
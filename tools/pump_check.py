@@ -124,7 +124,7 @@ def main(argv):
         warn_if_daemon_running()
         rig = Rig()
         if not rig.open():
-            print(f"!! No CDC port ({rig.cdc.reason}). Checks that read settings.json")
+            print(f"!! No CDC port ({rig.cdc.reason}). Checks that read flash")
             print("   will report themselves as unable to run.\n")
         print(f"Opened {rig.device.manufacturer} {rig.device.product}\n")
 
@@ -11,6 +11,8 @@ actually for lives here:
     BAD_ACTION (unknown, and valid-but-wrong-gesture), BAD_MAGIC
   - SET_MAPPING is live in RAM and slot-scoped; COMMIT and RESET both ACK, and
     RESET restores the defaults
+  - a BEGIN/END_MAPPINGS batch applies whole on one counted ACK, and a batch
+    with a rejected SET applies nothing
   - COMMIT_MAPPINGS actually reaches flash, and SET_MAPPING actually does not
   - FORWARD's param -- the control appearance -- is stored verbatim, reserved
     values included, because degradation is a render-time rule
@@ -45,14 +47,17 @@ from .firmware import (
 from .transport import (
     HOST_TIMEOUT_S,
     ask,
+    begin_mappings,
     bulk_dump,
     commit_mappings,
     describe,
+    end_mappings,
     expect_error,
     get_mapping,
     report,
     reset_mappings,
     set_mapping,
+    stage_mapping,
     unattended,
 )
 
@@ -248,6 +253,64 @@ def check_set_commit_reset(session):
     return report("SET / COMMIT / RESET round-trip", problems)
 
 
+def check_batch(session):
+    """BEGIN_MAPPINGS ... END_MAPPINGS: one ACK, all or nothing.
+
+    A SET_MAPPING inside the batch must not be answered -- its silence is what
+    the batch buys -- and must not be visible to GET_MAPPING until END.
+    """
+    name = "SET_MAPPING batch"
+    problems = []
+    batch = (
+        (ControlId.LIFT, Gesture.PRESS, Action.FORWARD),
+        (ControlId.DROP, Gesture.PRESS, Action.FORWARD),
+        (ControlId.REVERSE, Gesture.PRESS, Action.FORWARD),
+    )
+
+    frame = begin_mappings(session)
+    if frame is None or frame[1] != MessageType.ACK:
+        return report(name, ["BEGIN_MAPPINGS did not ACK"])
+    for control, gesture, action in batch:
+        stage_mapping(session, control, CONNECTED, gesture, action)
+
+    frame = get_mapping(session, ControlId.LIFT, CONNECTED, Gesture.PRESS)
+    if frame is None or frame[1] != MessageType.MAPPING:
+        problems.append("GET_MAPPING inside the batch got no MAPPING back -- was a SET answered?")
+    elif frame[5] == Action.FORWARD:
+        problems.append("a batched SET_MAPPING took effect before END_MAPPINGS")
+
+    frame = end_mappings(session)
+    if frame is None or frame[1] != MessageType.ACK:
+        problems.append("END_MAPPINGS did not ACK")
+    else:
+        count = frame[4] | (frame[5] << 8)
+        if count != len(batch):
+            problems.append(f"END_MAPPINGS counted {count} row(s), expected {len(batch)}")
+        if frame[6]:
+            problems.append("END_MAPPINGS without the commit flag reported a commit")
+    for control, gesture, action in batch:
+        frame = get_mapping(session, control, CONNECTED, gesture)
+        if frame is None or frame[5] != action:
+            problems.append(f"{control_name(control)} was not applied by END_MAPPINGS")
+
+    # One bad row poisons the batch: nothing else in it may land.
+    reset_mappings(session, RESET_MAPPINGS_MAGIC)
+    begin_mappings(session)
+    stage_mapping(session, ControlId.LIFT, CONNECTED, Gesture.PRESS, Action.FORWARD)
+    stage_mapping(session, ControlId.ENCODER, CONNECTED, Gesture.TAP, Action.FORWARD)
+    problems.append(
+        expect_error(end_mappings(session), ErrorCode.BAD_CONTROL, "END_MAPPINGS after a bad row")
+    )
+    frame = get_mapping(session, ControlId.LIFT, CONNECTED, Gesture.PRESS)
+    if frame is None or frame[5] != Action.MODE_LIFT:
+        problems.append("a rejected batch still applied its good rows")
+
+    if (reset_mappings(session, RESET_MAPPINGS_MAGIC) or [0, 0])[1] != MessageType.ACK:
+        problems.append("RESET_MAPPINGS did not ACK")
+
+    return report(name, [p for p in problems if p])
+
+
 def check_appearance_param(session):
     """FORWARD's param is the control appearance: stored verbatim, never refused.
 
@@ -296,7 +359,7 @@ def check_commit_persistence(session, probe):
     with the commit never having reached flash in the first place -- the
     evidence gets destroyed by the thing being used to test it.
 
-    Reading settings.json over CDC *between* the commit and the reset settles
+    Reading mappings.bin over CDC (`mappings:dump`) *between* the commit and the reset settles
     it, and the same read proves the other half of the contract for free:
     SET_MAPPING alone must be RAM only. GET_MAPPING cannot distinguish the two,
     since it answers from RAM either way.
@@ -306,7 +369,7 @@ def check_commit_persistence(session, probe):
     name = "COMMIT_MAPPINGS reaches flash, SET_MAPPING does not"
     problems = []
     if not probe.available:
-        return report(name, [f"needs the CDC port to read settings.json ({probe.reason})"])
+        return report(name, [f"needs the CDC port to read mappings.bin ({probe.reason})"])
 
     # [control, slot, gesture, action, param], as mapping.py's commit() stores it.
     expected_row = [ControlId.REVERSE, CONNECTED, Gesture.PRESS, Action.FORWARD, 0]
@@ -316,7 +379,7 @@ def check_commit_persistence(session, probe):
 
     rows = probe.mappings()
     if rows is None:
-        return report(name, ["settings.json has no readable mappings key"])
+        return report(name, ["mappings:dump did not answer with a row list"])
     if rows:
         problems.append(f"flash still held {len(rows)} row(s) straight after a reset: {rows}")
 
@@ -326,7 +389,7 @@ def check_commit_persistence(session, probe):
 
     rows = probe.mappings()
     if rows is None:
-        problems.append("settings:dump stopped answering after SET_MAPPING")
+        problems.append("mappings:dump stopped answering after SET_MAPPING")
     elif expected_row in rows:
         problems.append(
             "SET_MAPPING alone wrote the row to flash -- it is specified as RAM only, "
@@ -341,10 +404,10 @@ def check_commit_persistence(session, probe):
 
     rows = probe.mappings()
     if rows is None:
-        problems.append("settings:dump stopped answering after COMMIT_MAPPINGS")
+        problems.append("mappings:dump stopped answering after COMMIT_MAPPINGS")
     elif expected_row not in rows:
         problems.append(
-            f"committed row absent from flash -- settings.json holds {rows}, "
+            f"committed row absent from flash -- mappings.bin holds {rows}, "
             f"expected to find {expected_row}"
         )
     else:
@@ -357,7 +420,7 @@ def check_commit_persistence(session, probe):
 
     rows = probe.mappings()
     if rows is None:
-        problems.append("settings:dump stopped answering after RESET_MAPPINGS")
+        problems.append("mappings:dump stopped answering after RESET_MAPPINGS")
     elif rows:
         problems.append(f"RESET_MAPPINGS left {rows} behind in flash")
     else:
@@ -522,6 +585,7 @@ def run(rig):
     results.append(check_send_key_sentinel(bulk) if bulk else False)
     results.append(check_errors(session))
     results.append(check_set_commit_reset(session))
+    results.append(check_batch(session))
     results.append(check_appearance_param(session))
     results.append(check_commit_persistence(session, probe))
 
@@ -18,6 +18,7 @@ Two different things live here, and the difference is the whole point:
 `mapping.py` cannot be imported (it pulls in `utime` and `.enums`), so the
 `Gesture` and `Action` vocabularies and the `DEFAULTS` table are read out of it
 with `ast`. That is a parse, not an execution: nothing in `mapping.py` runs.
+`usb_manager.py`'s Pixel Pump 1 command ids are read the same way.
 """
 
 import ast
@@ -28,6 +29,7 @@ import sys
 REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 SRC_ROOT = os.path.join(REPO_ROOT, "src")
 MAPPING_PY = os.path.join(SRC_ROOT, "pixel_pump", "mapping.py")
+USB_MANAGER_PY = os.path.join(SRC_ROOT, "pixel_pump", "usb", "usb_manager.py")
 MPCONFIGBOARD_H = os.path.join(REPO_ROOT, "boards", "PIXEL_PUMP", "mpconfigboard.h")
 
 if SRC_ROOT not in sys.path:
@@ -214,6 +216,32 @@ GESTURE_NAMES = {value: name for name, value in firmware().enum("Gesture").items
 ACTION_NAMES = {value: name for name, value in firmware().enum("Action").items()}
 
 
+def _usb_manager():
+    """`PP1CommandId` and the module's int constants, out of `usb_manager.py`."""
+    with open(USB_MANAGER_PY, "r", encoding="utf-8") as handle:
+        tree = ast.parse(handle.read(), filename=USB_MANAGER_PY)
+    command_ids = None
+    constants = {}
+    for stmt in tree.body:
+        if isinstance(stmt, ast.ClassDef) and stmt.name == "PP1CommandId":
+            command_ids = _class_constants(stmt)
+        elif isinstance(stmt, ast.Assign):
+            value = _literal(stmt.value)
+            if value is _MISSING:
+                continue
+            for target in stmt.targets:
+                if isinstance(target, ast.Name):
+                    constants[target.id] = value
+    if command_ids is None:
+        raise FirmwareParseError(f"{USB_MANAGER_PY} defines no class PP1CommandId")
+    return command_ids, constants
+
+
+_pp1_command_ids, _usb_constants = _usb_manager()
+PP1CommandId = _Namespace("PP1CommandId", _pp1_command_ids)
+MAPPINGS_COMMIT = _usb_constants["MAPPINGS_COMMIT"]
+
+
 def gesture_name(gesture):
     return GESTURE_NAMES.get(gesture, str(gesture))
 
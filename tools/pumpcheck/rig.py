@@ -14,9 +14,9 @@ from .transport import (
     vendor_present,
 )
 
-# The boot sequence (rainbow sweep + valve clicks) runs before the main loop, so
-# give a rebooted pump time to become answerable rather than racing it.
-BOOT_SETTLE_S = 2.0
+# The boot sequence plays inside the main loop, which answers from its first
+# pass; this only covers the settings load and USB init ahead of that.
+BOOT_SETTLE_S = 0.5
 ENUMERATION_TIMEOUT_S = 30.0
 
 
@@ -30,6 +30,7 @@ import hid
 
 from .firmware import (
     MAPPING_ALL,
+    MAPPINGS_COMMIT,
     PID,
     REPORT_SIZE,
     VENDOR_USAGE_PAGE,
@@ -37,6 +38,7 @@ from .firmware import (
     CommandId,
     EventKind,
     MessageType,
+    PP1CommandId,
     error_name,
 )
 
@@ -293,6 +295,32 @@ def commit_mappings(session, timeout_s=3.0):
     return session.read(timeout_s, want=(MessageType.ACK, MessageType.ERROR))
 
 
+def begin_mappings(session, timeout_s=2.0):
+    session.command(PP1CommandId.BEGIN_MAPPINGS)
+    return session.read(timeout_s, want=(MessageType.ACK, MessageType.ERROR))
+
+
+def stage_mapping(session, control, slot, gesture, action, param=0):
+    """SET_MAPPING inside a batch: only a rejection is answered, so don't wait."""
+    session.command(
+        CommandId.SET_MAPPING,
+        b4=control,
+        b5=(slot << 4) | gesture,
+        b6=action,
+        b7=param,
+    )
+
+
+def end_mappings(session, commit=False, timeout_s=3.0):
+    """END_MAPPINGS' answer, skipping the ERRORs of SET_MAPPINGs staged before it."""
+    session.command(PP1CommandId.END_MAPPINGS, b4=MAPPINGS_COMMIT if commit else 0)
+    return session.read(
+        timeout_s,
+        want=(MessageType.ACK, MessageType.ERROR),
+        match=lambda f: f[3] == PP1CommandId.END_MAPPINGS,
+    )
+
+
 def bulk_dump(session, timeout_s=6.0):
     """Every non-NONE entry, as (control, slot, gesture, action, param)."""
     session.command(CommandId.GET_MAPPING, b4=MAPPING_ALL)
@@ -392,12 +420,20 @@ class ModeProbe:
         return None if settings is None else settings.get("mode")
 
     def mappings(self):
-        """The persisted override rows, as lists. None if the dump failed."""
-        settings = self.dump()
-        if settings is None:
-            return None
-        rows = settings.get("mappings")
-        return None if not isinstance(rows, list) else [list(row) for row in rows]
+        """The persisted override rows, as lists. None if the dump failed.
+
+        `mappings:dump` reads mappings.bin back from flash, like `dump()` does
+        settings.json.
+        """
+        for line in self.send("mappings:dump").splitlines():
+            line = line.strip()
+            if line.startswith("["):
+                try:
+                    rows = json.loads(line)
+                except ValueError:
+                    return None
+                return None if not isinstance(rows, list) else [list(row) for row in rows]
+        return None
 
     def version_info(self):
         """`version:info` -> "tag,branch,commit_hash,timestamp", or None."""